@@ -0,0 +1,110 @@
+"""Helper script to time the larger pipeline steps on generated data."""
+import os
+import time
+import tracemalloc
+from typing import Callable, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.kwargs_quality_adjustment import get_quality_adjustments
+from src.quality_adjustment_parallel import get_quality_adjustments_parallel
+from test.slice_parametrisation import PackedMask, add_N2_markers, shift_mask
+
+
+# The number of rows to time each function over, and monthly periods.
+ROWS = [125_000, 250_000, 500_000, 1_000_000]
+PERIODS = 120
+
+
+def main() -> None:
+    """Run the benchmarks."""
+    bench_add_N2_markers(ROWS, PERIODS)
+    bench_shift_mask(ROWS[-1], PERIODS)
+    bench_quality_adjustments_parallel(ROWS[-1], PERIODS)
+
+
+def bench_add_N2_markers(rows: Sequence[int], periods: int) -> None:
+    """Time add_N2_markers on random marker frames of increasing size."""
+    print("add_N2_markers")
+    for n in rows:
+        markers = _random_markers(n, periods)
+        seconds = _time(lambda: add_N2_markers(markers))
+        print(f"  {n:>9} rows: {seconds:.2f}s ({seconds / n * 1e6:.2f}us/row)")
+
+
+def bench_shift_mask(rows: int, periods: int) -> None:
+    """Time shift_mask and its peak memory for each mask storage."""
+    mask = _random_markers(rows, periods) == 'N'
+    packed = PackedMask.from_frame(mask)
+    out = np.empty(mask.shape, dtype=bool)
+
+    print(f"shift_mask ({rows} x {periods})")
+    for label, func in [
+        ("pandas shift", lambda: mask.shift(1, axis=1).fillna(False)),
+        ("frame", lambda: shift_mask(mask, exclude=[1])),
+        ("frame, out=", lambda: shift_mask(mask, exclude=[1], out=out)),
+        ("packed", lambda: shift_mask(packed, exclude=[1])),
+    ]:
+        seconds, peak = _time_and_peak(func)
+        print(f"  {label:>12}: {seconds:.3f}s, peak {peak / 2**20:.1f} MiB")
+
+
+def bench_quality_adjustments_parallel(rows: int, periods: int) -> None:
+    """Time the parallel quality adjustments for increasing workers."""
+    rng = np.random.default_rng(0)
+    columns = pd.date_range('2010-01-01', periods=periods, freq='MS')
+    quality_value = pd.DataFrame(
+        rng.integers(1, 5, size=(rows, periods)).astype(float),
+        columns=columns,
+    )
+    to_reset = pd.DataFrame(rng.random((rows, periods)) < 0.1, columns=columns)
+
+    print(f"get_quality_adjustments ({rows} x {periods})")
+    seconds = _time(lambda: get_quality_adjustments(
+        quality_value, to_reset, engine='numpy',
+    ))
+    print(f"  {'numpy':>12}: {seconds:.2f}s")
+
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        for executor in ['thread', 'process']:
+            seconds = _time(lambda: get_quality_adjustments_parallel(
+                quality_value, to_reset, workers=workers, executor=executor,
+            ))
+            print(f"  {executor:>7} x {workers:>2}: {seconds:.2f}s")
+        workers *= 2
+
+
+def _random_markers(rows: int, periods: int, seed: int = 0) -> pd.DataFrame:
+    """Return a marker frame with long runs of M and T markers."""
+    rng = np.random.default_rng(seed)
+    markers = rng.choice(
+        np.array(['', 'N', 'M', 'T'], dtype=object),
+        size=(rows, periods),
+        p=[0.55, 0.15, 0.15, 0.15],
+    )
+    columns = pd.date_range('2010-01-01', periods=periods, freq='MS')
+    return pd.DataFrame(markers, columns=columns)
+
+
+def _time(func: Callable[[], object]) -> float:
+    """Return the wall time of a single call in seconds."""
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def _time_and_peak(func: Callable[[], object]) -> Tuple[float, int]:
+    """Return the wall time and peak traced memory of a single call."""
+    tracemalloc.start()
+    try:
+        seconds = _time(func)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak
+
+
+if __name__ == "__main__":
+    main()
@@ -2,15 +2,32 @@
 import os
 import re
 import glob
+import hashlib
+import importlib.util
+import inspect
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import repeat
 from pathlib import Path
-from typing import Sequence, Callable
+from typing import (
+    Any, Dict, Iterator, List, Mapping, NamedTuple, Optional, Sequence,
+    Callable, Union,
+)
 
+import numpy as np
 import pandas as pd
 
 
 # Define the directory to find CSVs and optional output TXT directory.
 CSV_DIR = '/path/to/your/dir/'
 TXT_DIR = CSV_DIR
+# Records what each TXT was converted from, so unchanged CSVs are
+# skipped. Set to None to always convert every file.
+MANIFEST = os.path.join(TXT_DIR, 'csv_to_text_manifest.json')
+# The number of rows formatted and written to the TXT at a time.
+WRITE_CHUNKSIZE = 10_000
 
 
 def main() -> None:
@@ -24,7 +41,9 @@ def main() -> None:
 
     files = glob.glob(CSV_DIR + '*fixed_base*.csv')
 
-    convert_all_csvs(files)
+    # Set workers > 1 to convert the files in parallel, and binary=True
+    # to also write .npz fixtures for helpers.load_fixture.
+    convert_all_csvs(files, workers=1, manifest=MANIFEST)
 
 
 def preprocess(df) -> pd.DataFrame:
@@ -33,48 +52,234 @@ def preprocess(df) -> pd.DataFrame:
     return df.unstack('group')
 
 
-def _generate_test_data(df: pd.DataFrame, filename: str) -> None:
-    """Generate hard-coded test data from a DataFrame."""
+def _generate_test_data(
+    df: pd.DataFrame,
+    filename: str,
+    chunksize: int = WRITE_CHUNKSIZE,
+) -> None:
+    """Generate hard-coded test data from a DataFrame.
+
+    The rows are formatted and written a chunk at a time, so memory
+    stays flat however large the frame is.
+    """
     df = preprocess(df)
 
     headers = (df.index.name,) + tuple(df.columns)
-    df_as_list = list(df.itertuples(index=True, name=None))
 
-    with open(filename, 'w') as f:
+    with open(filename, 'w', buffering=2**20) as f:
         f.write(str(headers)+',\n')
-        f.write('\n'.join(str(t)+',' for t in df_as_list))
+        for i, lines in enumerate(_iter_tuple_lines(df, chunksize)):
+            if i:
+                f.write('\n')
+            f.write('\n'.join(lines))
+
+
+def _generate_binary_data(df: pd.DataFrame, filename: str) -> None:
+    """Generate a binary .npz fixture from a DataFrame.
+
+    Holds the same data as the tuple text, but is loaded with
+    helpers.load_fixture rather than compiled on import. The index
+    name and each level of the column labels are stored as typed
+    arrays, as are the index and each column.
+    """
+    df = preprocess(df)
+
+    header = {
+        'header_index': _to_storable(pd.Index([df.index.name], name='index name')),
+        **{
+            f'header_level_{k}': _to_storable(
+                df.columns.get_level_values(k).rename('column labels')
+            )
+            for k in range(df.columns.nlevels)
+        },
+    }
+    columns = [df.index] + [df.iloc[:, j] for j in range(df.shape[1])]
+
+    np.savez_compressed(
+        filename,
+        **header,
+        **{f'column_{i}': _to_storable(col) for i, col in enumerate(columns)},
+    )
+
+
+def _to_storable(values: Union[pd.Index, pd.Series]) -> np.ndarray:
+    """Return the values as an array that can be saved without pickle."""
+    arr = values.to_numpy()
+    if arr.dtype != object:
+        return arr
+
+    if all(isinstance(v, str) for v in arr):
+        return arr.astype(str)
+
+    raise TypeError(
+        f"Can't store {values.name!r} in a binary fixture, only numbers, "
+        "dates, bools or strings without missing values."
+    )
+
+
+def _iter_tuple_lines(df: pd.DataFrame, chunksize: int) -> Iterator[List[str]]:
+    """Yield the rows of df as tuple text lines, a chunk at a time.
+
+    Each line is the same as str() of the row from df.itertuples with
+    a trailing comma.
+    """
+    for start in range(0, len(df), chunksize):
+        chunk = df.iloc[start:start + chunksize]
+        columns = [_repr_values(chunk.index)] + [
+            _repr_values(chunk.iloc[:, j]) for j in range(chunk.shape[1])
+        ]
+
+        if len(columns) == 1:
+            # A single value tuple has a comma before the bracket.
+            yield [f"({v},)," for v in columns[0]]
+        else:
+            yield ['(' + ', '.join(row) + '),' for row in zip(*columns)]
+
+
+def _repr_values(values: Union[pd.Index, pd.Series]) -> List[str]:
+    """Return the repr of each value, as it appears in a tuple."""
+    if (
+        pd.api.types.is_datetime64_dtype(values.dtype)
+        # Timestamps from an index with a freq show it in their repr.
+        and getattr(values, 'freq', None) is None
+        and not values.isna().any()
+    ):
+        dates = pd.DatetimeIndex(values)
+        # Timestamps with only whole seconds all repr the same way.
+        if not (dates.microsecond.any() or dates.nanosecond.any()):
+            return [
+                f"Timestamp('{d}')"
+                for d in dates.strftime('%Y-%m-%d %H:%M:%S')
+            ]
+
+    # Python scalars from tolist repr the same as in itertuples.
+    return list(map(repr, values.tolist()))
 
 
 def _load(
     filename: str,
     date_parser: Callable[[str], pd.Series] = None,
+    date_format: Optional[str] = None,
+    dtype: Optional[Mapping[str, Any]] = None,
+    engine: str = 'c',
 ) -> pd.DataFrame:
-    """Quick load file with optional date parser."""
-    return pd.read_csv(
-        filename,
-        index_col=['month', 'group'],
-        parse_dates=True,
-        dayfirst=True,
-        date_parser=date_parser,
-    )
+    """Quick load file with optional date parser.
+
+    Parameters
+    ----------
+    filename: str
+        The CSV to load.
+    date_parser: callable, optional
+        To convert date types in formats not picked up by pandas.
+    date_format: str, optional
+        The format of the month column, e.g. '%Y%m' for "201701". The
+        months are converted in one vectorised pd.to_datetime call,
+        which is much faster than a date_parser. Only one of
+        date_parser and date_format can be given.
+    dtype: dict, optional
+        Explicit dtypes for the other columns, to skip inference.
+    engine: {'c', 'python', 'pyarrow'}, default 'c'
+        The read_csv engine. 'pyarrow' needs pyarrow to be installed.
+
+    Raises
+    ------
+    ValueError
+        If both date_parser and date_format are given.
+
+    """
+    if date_parser is not None and date_format is not None:
+        raise ValueError("Only one of date_parser or date_format can be given.")
+
+    if date_format is None and engine != 'pyarrow':
+        return pd.read_csv(
+            filename,
+            index_col=['month', 'group'],
+            parse_dates=True,
+            dayfirst=True,
+            date_parser=date_parser,
+            dtype=dtype,
+            engine=engine,
+        )
+
+    # Read the months as strings and convert them in one go. The
+    # pyarrow engine always does this as it doesn't support dayfirst.
+    df = pd.read_csv(filename, dtype={**(dtype or {}), 'month': str}, engine=engine)
+
+    if date_parser is not None:
+        df['month'] = date_parser(df['month'])
+    else:
+        df['month'] = pd.to_datetime(
+            df['month'], format=date_format, dayfirst=date_format is None,
+        )
+
+    return df.set_index(['month', 'group'])
+
+
+def compare_loaders(
+    filename: str,
+    engines: Sequence[str] = ('c', 'pyarrow'),
+    **load_options: Any,
+) -> Dict[str, float]:
+    """Print and return the time taken to load the file with each engine.
+
+    Any engine that isn't installed is reported and skipped. The
+    load_options are passed to _load, e.g. date_format='%Y%m'.
+    """
+    timings = {}
+    for engine in engines:
+        if engine == 'pyarrow' and importlib.util.find_spec('pyarrow') is None:
+            print(f"{engine}: not installed")
+            continue
+
+        start = time.perf_counter()
+        _load(filename, engine=engine, **load_options)
+        timings[engine] = time.perf_counter() - start
+        print(f"{engine}: {timings[engine]:.3f}s")
+
+    return timings
 
 
 def convert_all_csvs(
     files: Sequence[str] = glob.glob(CSV_DIR + '*.csv'),
     date_parser: Callable[[str], pd.Series] = None,
-) -> None:
+    workers: int = 1,
+    manifest: Optional[str] = None,
+    load_options: Optional[Mapping[str, Any]] = None,
+    binary: bool = False,
+) -> List['ConversionResult']:
     """Convert all CSVs to tuple text data.
 
     Default behaviour is to convert all files in directory given by
     CSV_TXT, but files can be specified using files argument.
 
+    A file that fails to convert is reported with the time taken for
+    each file, and doesn't stop the rest from being converted.
+
     Parameters
     ----------
     files: list of str, optional
         The filenames to convert.
     date_parser: callable, optional
         To convert date types in formats not picked up by pandas i.e.
-        "201701".
+        "201701". Must be picklable (not a lambda) if workers > 1.
+    workers: int, default 1
+        The number of processes to spread the files across. The
+        output is the same as converting them one by one.
+    manifest: str, optional
+        Path to a JSON manifest of the CSV hash, preprocess fingerprint
+        and TXT (and .npz if binary) hash for each converted file. If
+        given, only new or changed CSVs (or ones with a missing or
+        edited output) are converted, and stale outputs are reported.
+    load_options: dict, optional
+        Extra arguments for _load, i.e. date_format, dtype and engine.
+    binary: bool, default False
+        Also write each file as an .npz next to the TXT, to be loaded
+        with helpers.load_fixture instead of pasting in the tuples.
+
+    Returns
+    -------
+    list of ConversionResult
+        The outcome of converting each file, in the order given.
 
     """
     files = [
@@ -89,9 +294,258 @@ def convert_all_csvs(
         for s in files
     ]
 
-    for i, file in enumerate(files):
-        df = _load(file, date_parser)
-        _generate_test_data(df, txt_files[i])
+    if manifest:
+        entries = _read_manifest(manifest)
+        fingerprint = _get_fingerprint(date_parser, load_options, binary)
+        to_convert = [
+            i for i, file in enumerate(files)
+            if not _is_up_to_date(file, txt_files[i], entries, fingerprint, binary)
+        ]
+    else:
+        to_convert = list(range(len(files)))
+
+    csvs = [files[i] for i in to_convert]
+    txts = [txt_files[i] for i in to_convert]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            converted = list(executor.map(
+                _convert_csv, csvs, txts,
+                repeat(date_parser), repeat(load_options), repeat(binary),
+            ))
+    else:
+        converted = [
+            _convert_csv(file, txts[i], date_parser, load_options, binary)
+            for i, file in enumerate(csvs)
+        ]
+
+    if manifest:
+        _update_manifest(manifest, entries, converted, fingerprint, binary)
+
+    # Files that are up to date are reported as skipped.
+    results = [
+        ConversionResult(file, txt_files[i], 0, skipped=True)
+        for i, file in enumerate(files)
+    ]
+    for i, result in zip(to_convert, converted):
+        results[i] = result
+
+    _report(results)
+    return results
+
+
+class ConversionResult(NamedTuple):
+    """The outcome of converting a single CSV to tuple text data."""
+
+    csv_file: str
+    txt_file: str
+    seconds: float
+    error: Optional[str] = None
+    skipped: bool = False
+
+
+def _convert_csv(
+    csv_file: str,
+    txt_file: str,
+    date_parser: Callable[[str], pd.Series] = None,
+    load_options: Optional[Mapping[str, Any]] = None,
+    binary: bool = False,
+) -> ConversionResult:
+    """Convert a single CSV, catching any error so the batch carries on."""
+    start = time.perf_counter()
+    try:
+        df = _load(csv_file, date_parser, **(load_options or {}))
+        _generate_test_data(df, txt_file)
+        if binary:
+            _generate_binary_data(df, _get_binary_file(txt_file))
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+
+    return ConversionResult(
+        csv_file, txt_file, time.perf_counter() - start, error,
+    )
+
+
+def _get_binary_file(txt_file: str) -> str:
+    """Return the .npz filename written alongside the TXT."""
+    return os.path.splitext(txt_file)[0] + '.npz'
+
+
+def _report(results: Sequence[ConversionResult]) -> None:
+    """Print the time taken for each file and any failures."""
+    for result in results:
+        if result.skipped:
+            status = "up to date"
+        elif result.error:
+            status = f"FAILED ({result.error})"
+        else:
+            status = "ok"
+        print(f"{result.csv_file}: {result.seconds:.2f}s {status}")
+
+    converted = sum(not r.skipped and r.error is None for r in results)
+    skipped = sum(r.skipped for r in results)
+    print(
+        f"Converted {converted} of {len(results)} files "
+        f"({skipped} up to date)."
+    )
+
+
+def _read_manifest(manifest: str) -> Dict[str, Dict[str, Any]]:
+    """Return the manifest entries keyed by CSV path, empty if no file."""
+    if not os.path.exists(manifest):
+        return {}
+
+    with open(manifest) as f:
+        entries = json.load(f)
+
+    # Report TXTs left behind by CSVs that have since been removed, and
+    # drop their entries so each is only reported once.
+    for csv_file in [f for f in entries if not os.path.exists(f)]:
+        entry = entries.pop(csv_file)
+        if os.path.exists(entry['txt_file']):
+            print(f"Stale: {entry['txt_file']} ({csv_file} no longer exists)")
+
+    return entries
+
+
+def _update_manifest(
+    manifest: str,
+    entries: Dict[str, Dict[str, Any]],
+    results: Sequence[ConversionResult],
+    fingerprint: str,
+    binary: bool = False,
+) -> None:
+    """Record the converted files in the manifest and write it."""
+    for result in results:
+        if result.error:
+            entries.pop(result.csv_file, None)
+            continue
+
+        entries[result.csv_file] = {
+            **_get_file_entry(result.csv_file, 'csv'),
+            'fingerprint': fingerprint,
+            'txt_file': result.txt_file,
+            **_get_file_entry(result.txt_file, 'txt'),
+        }
+        if binary:
+            entries[result.csv_file].update(
+                _get_file_entry(_get_binary_file(result.txt_file), 'npz')
+            )
+
+    with open(manifest, 'w') as f:
+        json.dump(entries, f, indent=2, sort_keys=True)
+
+
+def _is_up_to_date(
+    csv_file: str,
+    txt_file: str,
+    entries: Dict[str, Dict[str, Any]],
+    fingerprint: str,
+    binary: bool = False,
+) -> bool:
+    """Return True if the TXT (and .npz) was made from the CSV as it is now."""
+    entry = entries.get(csv_file)
+    if (
+        entry is None
+        or entry['fingerprint'] != fingerprint
+        or entry['txt_file'] != txt_file
+        or not os.path.exists(csv_file)
+    ):
+        return False
+
+    outputs = [(txt_file, 'txt')]
+    if binary:
+        outputs.append((_get_binary_file(txt_file), 'npz'))
+
+    for filename, prefix in outputs:
+        if not os.path.exists(filename):
+            return False
+        if not _is_unchanged(filename, entry, prefix):
+            print(f"Stale: {filename} has changed since it was generated")
+            return False
+
+    return _is_unchanged(csv_file, entry, 'csv')
+
+
+def _get_file_entry(filename: str, prefix: str) -> Dict[str, Any]:
+    """Return the hash, size and modified time of the file to record."""
+    stat = os.stat(filename)
+    return {
+        f'{prefix}_hash': _hash_file(filename),
+        f'{prefix}_size': stat.st_size,
+        f'{prefix}_mtime_ns': stat.st_mtime_ns,
+    }
+
+
+def _is_unchanged(filename: str, entry: Dict[str, Any], prefix: str) -> bool:
+    """Return True if the file has the hash recorded in the entry.
+
+    The file is only hashed if its size or modified time have changed.
+    If the content is the same, the new ones are recorded in the entry
+    so the file isn't hashed again on the next run.
+    """
+    stat = os.stat(filename)
+    if (
+        stat.st_size == entry.get(f'{prefix}_size')
+        and stat.st_mtime_ns == entry.get(f'{prefix}_mtime_ns')
+    ):
+        return True
+
+    if _hash_file(filename) != entry[f'{prefix}_hash']:
+        return False
+
+    entry[f'{prefix}_size'] = stat.st_size
+    entry[f'{prefix}_mtime_ns'] = stat.st_mtime_ns
+    return True
+
+
+def _get_fingerprint(
+    date_parser: Callable[[str], pd.Series] = None,
+    load_options: Optional[Mapping[str, Any]] = None,
+    binary: bool = False,
+) -> str:
+    """Return a hash of the code and options that affect the output."""
+    sources = [repr(sorted((load_options or {}).items()))]
+    funcs = [
+        preprocess, _generate_test_data, _iter_tuple_lines, _repr_values,
+        _load, date_parser,
+    ]
+    if binary:
+        funcs += [_generate_binary_data, _to_storable]
+    sources += [_describe(func) for func in funcs if func is not None]
+
+    return hashlib.sha256('\n'.join(sources).encode()).hexdigest()
+
+
+def _describe(func: Callable[..., Any]) -> str:
+    """Return a description of func that is the same in every process.
+
+    Uses the source where there is one. Otherwise uses the module and
+    name rather than the repr, which can hold a memory address, and
+    for a partial describes the function and the arguments it holds.
+    """
+    if isinstance(func, partial):
+        return '\n'.join([
+            _describe(func.func),
+            repr(func.args),
+            repr(sorted(func.keywords.items())),
+        ])
+
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        name = getattr(func, '__qualname__', type(func).__qualname__)
+        return f"{getattr(func, '__module__', None)}.{name}"
+
+
+def _hash_file(filename: str) -> str:
+    """Return the SHA-256 hash of the file content."""
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            sha.update(block)
+    return sha.hexdigest()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,193 @@
+"""Segmented window operations over base periods."""
+from typing import Callable, Union
+
+import numpy as np
+import pandas as pd
+
+ArrayOrFrame = Union[np.ndarray, pd.DataFrame]
+
+
+class BasePeriodWindow:
+    """The windows of a set of dates covered by each base period.
+
+    Base prices are refreshed each year and apply from the base month
+    through to the month before it in the following year (Feb-Jan+1 by
+    default). The window offsets are computed once so the reductions
+    and scans can be reused across a pipeline run.
+
+    For contiguous monthly dates the windows are the same as the ones
+    given by shifted_within_year_apply. With gaps in the months, set
+    `shifted` to group as it does.
+
+    Parameters
+    ----------
+    dates: DatetimeIndex
+        The sorted period dates, i.e. the columns of a price panel.
+    base_month: int, default 2
+        The month each base period starts in.
+    shifted: bool, default False
+        Group each period on the month after the period before it,
+        rather than its own month, as shifted_within_year_apply does.
+        The first period is grouped on its own month.
+
+    Attributes
+    ----------
+    months: ndarray
+        The month of each period.
+    period_labels: ndarray
+        The year of the base period covering each period.
+    labels: Index
+        The year of each base period window.
+    starts, stops: ndarray
+        The integer offsets bounding each window.
+    is_window_end: ndarray
+        Boolean array, True for the last period in each window.
+
+    Examples
+    --------
+    >>> window = BasePeriodWindow(df.columns)
+    >>> window.cumprod(df, axis=1)
+
+    """
+
+    def __init__(
+        self,
+        dates: pd.DatetimeIndex,
+        base_month: int = 2,
+        shifted: bool = False,
+    ):
+        """Initialise objects."""
+        dates = pd.DatetimeIndex(dates)
+        if not dates.is_monotonic_increasing:
+            raise ValueError("Dates must be sorted in increasing order.")
+
+        self.dates = dates
+        self.base_month = base_month
+        self.shifted = shifted
+        self.months = dates.month.to_numpy()
+
+        # Count the months from year 0 to group on.
+        months = dates.year.to_numpy() * 12 + self.months
+        if shifted:
+            months[1:] = months[:-1] + 1
+        self.period_labels = (months - base_month) // 12
+
+        changes = self.period_labels[1:] != self.period_labels[:-1]
+        self.starts = np.flatnonzero(np.r_[len(dates) > 0, changes])
+        self.stops = np.r_[self.starts[1:], len(dates)].astype(self.starts.dtype)
+        self.labels = pd.Index(self.period_labels[self.starts], name='base_period')
+
+        self.is_window_end = np.zeros(len(dates), dtype=bool)
+        self.is_window_end[self.stops - 1] = True
+
+    def __len__(self) -> int:
+        """Return the number of windows."""
+        return len(self.starts)
+
+    def __repr__(self) -> str:
+        """Return string."""
+        return (
+            f"BasePeriodWindow(periods={len(self.dates)}, "
+            f"windows={len(self)}, base_month={self.base_month}, "
+            f"shifted={self.shifted})"
+        )
+
+    def cumprod(self, values: ArrayOrFrame, axis: int = 1) -> ArrayOrFrame:
+        """Return the cumulative product within each window, skipping NaN."""
+        return self._scan(values, axis, np.multiply.accumulate, fill=1)
+
+    def cumsum(self, values: ArrayOrFrame, axis: int = 1) -> ArrayOrFrame:
+        """Return the cumulative sum within each window, skipping NaN."""
+        return self._scan(values, axis, np.add.accumulate, fill=0)
+
+    def ffill(self, values: ArrayOrFrame, axis: int = 1) -> ArrayOrFrame:
+        """Forward fill NaN values within each window."""
+        arr = self._as_array(values, axis)
+        if not np.issubdtype(arr.dtype, np.floating):
+            return self._wrap_scan(arr.copy(), values, axis)
+
+        positions = np.where(np.isnan(arr), 0, np.arange(arr.shape[-1]))
+        # Pin each window start to itself so nothing carries over from
+        # the window before.
+        positions[..., self.starts] = self.starts
+        np.maximum.accumulate(positions, axis=-1, out=positions)
+
+        out = np.take_along_axis(arr, positions, axis=-1)
+        return self._wrap_scan(out, values, axis)
+
+    def any(self, values: ArrayOrFrame, axis: int = 1) -> ArrayOrFrame:
+        """Return whether any value is True within each window."""
+        arr = self._as_array(values, axis).astype(bool, copy=False)
+        out = np.logical_or.reduceat(arr, self.starts, axis=-1)
+        return self._wrap_reduction(out, values, axis)
+
+    def first(self, values: ArrayOrFrame, axis: int = 1) -> ArrayOrFrame:
+        """Return the value in the first period of each window."""
+        out = self._as_array(values, axis)[..., self.starts]
+        return self._wrap_reduction(out, values, axis)
+
+    def last(self, values: ArrayOrFrame, axis: int = 1) -> ArrayOrFrame:
+        """Return the value in the last period of each window."""
+        out = self._as_array(values, axis)[..., self.stops - 1]
+        return self._wrap_reduction(out, values, axis)
+
+    def _scan(
+        self,
+        values: ArrayOrFrame,
+        axis: int,
+        accumulate: Callable[..., np.ndarray],
+        fill: int,
+    ) -> ArrayOrFrame:
+        """Apply the accumulate ufunc method within each window."""
+        arr = self._as_array(values, axis)
+
+        if np.issubdtype(arr.dtype, np.floating):
+            nans = np.isnan(arr)
+            arr = np.where(nans, fill, arr)
+        else:
+            nans = None
+
+        out = np.empty_like(arr)
+        for start, stop in zip(self.starts, self.stops):
+            accumulate(arr[..., start:stop], axis=-1, out=out[..., start:stop])
+
+        if nans is not None:
+            out[nans] = np.nan
+
+        return self._wrap_scan(out, values, axis)
+
+    def _as_array(self, values: ArrayOrFrame, axis: int) -> np.ndarray:
+        """Return values as an array with the windowed axis last."""
+        arr = np.asarray(values)
+        if arr.shape[axis] != len(self.dates):
+            raise ValueError(
+                f"Length of axis {axis} does not match the window dates: "
+                f"{arr.shape[axis]} != {len(self.dates)}"
+            )
+        return np.moveaxis(arr, axis, -1)
+
+    def _wrap_scan(
+        self,
+        out: np.ndarray,
+        values: ArrayOrFrame,
+        axis: int,
+    ) -> ArrayOrFrame:
+        """Return the scan output in the same form as values."""
+        out = np.moveaxis(out, -1, axis)
+        if isinstance(values, pd.DataFrame):
+            return pd.DataFrame(out, index=values.index, columns=values.columns)
+        return out
+
+    def _wrap_reduction(
+        self,
+        out: np.ndarray,
+        values: ArrayOrFrame,
+        axis: int,
+    ) -> ArrayOrFrame:
+        """Return the reduction output labelled by window if a frame."""
+        out = np.moveaxis(out, -1, axis)
+        if isinstance(values, pd.DataFrame):
+            if axis == 0:
+                return pd.DataFrame(out, index=self.labels, columns=values.columns)
+            return pd.DataFrame(out, index=values.index, columns=self.labels)
+        return out
@@ -0,0 +1,251 @@
+"""Kernels for the sequential scans over periods.
+
+The scans are compiled with numba when it is installed, falling back
+to NumPy kernels that loop over the periods and work on every row at
+once. Both give identical results. Set the FORCE_NUMPY_KERNELS
+environment variable (to anything but 0) before import to use the
+NumPy kernels even when numba is installed.
+"""
+import os
+from typing import Optional
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+USE_NUMBA = (
+    numba is not None
+    and os.environ.get('FORCE_NUMPY_KERNELS', '0') in ('', '0')
+)
+
+# Integer codes for the markers relevant to adding N2s.
+OTHER, N, MT = 0, 1, 2
+
+
+def windowed_reset_cumprod(
+    values: np.ndarray,
+    adjust: Optional[np.ndarray],
+    reset: Optional[np.ndarray],
+    is_start: np.ndarray,
+    out: np.ndarray,
+) -> np.ndarray:
+    """Write the cumulative adjustment factors for the values to out.
+
+    Goes through the periods in order, keeping the cumulative growth
+    and the cumulative factor with resets applied for each row, both
+    set back to 1 at the start of each window. A reset multiplies in
+    the inverse of the cumulative growth, and missing factors are
+    skipped as in cumprod and filled with 1.
+
+    Parameters
+    ----------
+    values: ndarray
+        The 2-D (rows, periods) quality values.
+    adjust: ndarray, optional
+        Boolean mask of values to be adjusted, all if not given.
+    reset: ndarray, optional
+        Boolean mask of quality adjustments to be reset.
+    is_start: ndarray
+        Boolean array, True for the first period in each window.
+    out: ndarray
+        The float array to write the factors to, of the same shape as
+        values. The arithmetic is done in its dtype.
+
+    """
+    if USE_NUMBA:
+        _windowed_reset_cumprod_numba(
+            values,
+            np.broadcast_to(True, values.shape) if adjust is None else adjust,
+            np.broadcast_to(False, values.shape) if reset is None else reset,
+            is_start,
+            out,
+        )
+        return out
+
+    return _windowed_reset_cumprod_numpy(values, adjust, reset, is_start, out)
+
+
+def propagate_N2(codes: np.ndarray, is_window_end: np.ndarray) -> np.ndarray:
+    """Return the N2 mask for the coded markers in one forward scan.
+
+    Carries each N forward through any M or T markers until it lands
+    on a period with no M, N or T marker, dropping it at the end of a
+    base period window since the next period is covered by a new base
+    period.
+
+    Parameters
+    ----------
+    codes: ndarray
+        The 2-D (rows, periods) markers coded as OTHER, N or MT.
+    is_window_end: ndarray
+        Boolean array, True for the last period in each window.
+
+    """
+    mask = np.zeros(codes.shape, dtype=bool, order='F')
+    if USE_NUMBA:
+        _propagate_N2_numba(codes, is_window_end, mask)
+        return mask
+
+    return _propagate_N2_numpy(codes, is_window_end, mask)
+
+
+def _windowed_reset_cumprod_numpy(
+    values: np.ndarray,
+    adjust: Optional[np.ndarray],
+    reset: Optional[np.ndarray],
+    is_start: np.ndarray,
+    out: np.ndarray,
+) -> np.ndarray:
+    """Return windowed_reset_cumprod with a loop over the periods.
+
+    Only arrays the length of the rows are allocated, and the values
+    are divided a period at a time so aren't copied to the dtype of
+    out.
+    """
+    n_rows, n_periods = values.shape
+    # Missing factors and the first period are 1 i.e. no adjustment.
+    out[...] = 1
+
+    growth = np.ones(n_rows, dtype=out.dtype)
+    cumulative = np.ones(n_rows, dtype=out.dtype)
+    factors = np.empty(n_rows, dtype=out.dtype)
+    present = np.empty(n_rows, dtype=bool)
+    to_reset = np.empty(n_rows, dtype=bool)
+
+    # The first period has no period before it, so isn't in a window.
+    for j in range(1, n_periods):
+        # Divide size by the period before, quietly as pandas does.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(values[:, j], values[:, j - 1], out=factors)
+        if adjust is not None:
+            factors[~adjust[:, j]] = 1
+
+        if is_start[j]:
+            growth[:] = 1
+            cumulative[:] = 1
+
+        # Skip missing factors as cumprod does.
+        _is_present(factors, out=present)
+
+        if reset is not None:
+            with np.errstate(invalid='ignore'):
+                np.multiply(growth, factors, out=growth, where=present)
+            # Reset with the inverse cumulative growth, which is missing
+            # if the growth is.
+            np.logical_and(reset[:, j], present, out=to_reset)
+            with np.errstate(divide='ignore'):
+                np.divide(1, growth, out=factors, where=to_reset)
+            _is_present(factors, out=present)
+
+        with np.errstate(invalid='ignore'):
+            np.multiply(cumulative, factors, out=cumulative, where=present)
+
+        # A product can also be missing, i.e. inf * 0, and is filled.
+        np.copyto(out[:, j], cumulative, where=present)
+        out[np.isnan(out[:, j]), j] = 1
+
+    return out
+
+
+def _is_present(values: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """Return a mask of the values that aren't NaN, written to out."""
+    np.isnan(values, out=out)
+    return np.logical_not(out, out=out)
+
+
+def _windowed_reset_cumprod_loop(
+    values: np.ndarray,
+    adjust: np.ndarray,
+    reset: np.ndarray,
+    is_start: np.ndarray,
+    out: np.ndarray,
+) -> None:
+    """Write windowed_reset_cumprod to out an element at a time.
+
+    Each result is stored in an array of the out dtype before it is
+    used, so float32 rounds the same as the NumPy kernel.
+    """
+    n_rows, n_periods = values.shape
+    growth = np.ones(n_rows, dtype=out.dtype)
+    cumulative = np.ones(n_rows, dtype=out.dtype)
+    factor = np.empty(1, dtype=out.dtype)
+
+    for i in range(n_rows):
+        out[i, 0] = 1
+
+    for j in range(1, n_periods):
+        if is_start[j]:
+            growth[:] = 1
+            cumulative[:] = 1
+
+        for i in range(n_rows):
+            factor[0] = values[i, j] / values[i, j - 1]
+            if not adjust[i, j]:
+                factor[0] = 1
+
+            if np.isnan(factor[0]):
+                out[i, j] = 1
+                continue
+
+            growth[i] = growth[i] * factor[0]
+            if reset[i, j]:
+                factor[0] = 1 / growth[i]
+                if np.isnan(factor[0]):
+                    out[i, j] = 1
+                    continue
+
+            cumulative[i] = cumulative[i] * factor[0]
+            # A product can also be missing, i.e. inf * 0, and is filled.
+            out[i, j] = 1 if np.isnan(cumulative[i]) else cumulative[i]
+
+
+def _propagate_N2_numpy(
+    codes: np.ndarray,
+    is_window_end: np.ndarray,
+    mask: np.ndarray,
+) -> np.ndarray:
+    """Return propagate_N2 with a loop over the periods."""
+    pending = np.zeros(codes.shape[0], dtype=bool)
+
+    for j in range(codes.shape[1]):
+        col = codes[:, j]
+        mask[:, j] = pending & (col == OTHER)
+        pending = (pending & (col == MT)) | (col == N)
+
+        if is_window_end[j]:
+            pending[:] = False
+
+    return mask
+
+
+def _propagate_N2_loop(
+    codes: np.ndarray,
+    is_window_end: np.ndarray,
+    mask: np.ndarray,
+) -> None:
+    """Write propagate_N2 to mask an element at a time."""
+    n_rows, n_periods = codes.shape
+    pending = np.zeros(n_rows, dtype=np.bool_)
+
+    for j in range(n_periods):
+        for i in range(n_rows):
+            code = codes[i, j]
+            mask[i, j] = pending[i] and code == OTHER
+            pending[i] = (pending[i] and code == MT) or code == N
+
+        if is_window_end[j]:
+            pending[:] = False
+
+
+if numba is not None:
+    # The numpy error model gives NaN and inf for division by zero, as
+    # the NumPy kernels do. Releasing the GIL lets threads scale.
+    _jit = numba.njit(cache=True, nogil=True, error_model='numpy')
+    _windowed_reset_cumprod_numba = _jit(_windowed_reset_cumprod_loop)
+    _propagate_N2_numba = _jit(_propagate_N2_loop)
+else:
+    _windowed_reset_cumprod_numba = None
+    _propagate_N2_numba = None
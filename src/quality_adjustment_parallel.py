@@ -0,0 +1,192 @@
+"""Runs the quality adjustments on blocks of rows in parallel."""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from multiprocessing.shared_memory import SharedMemory
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .base_period import BasePeriodWindow
+from .kwargs_quality_adjustment import (
+    _as_factor_dtype,
+    _mask_as_array,
+    _scan_quality_adjustments,
+)
+
+# The name, shape and dtype of an array held in shared memory.
+SharedArraySpec = Tuple[str, Tuple[int, ...], str]
+
+
+def get_quality_adjustments_parallel(
+    quality_value: pd.DataFrame,
+    to_reset: Optional[pd.DataFrame] = None,
+    to_adjust: Optional[pd.DataFrame] = None,
+    workers: Optional[int] = None,
+    executor: str = 'thread',
+    block_rows: Optional[int] = None,
+    dtype: Any = np.float64,
+) -> pd.DataFrame:
+    """Return get_quality_adjustments computed on blocks of rows in parallel.
+
+    Each row is adjusted independently, so the rows are split into
+    blocks and each block is run through the same scan as the 'numpy'
+    engine. Each block writes to its own rows of one output array, so
+    the output is in the original order and is identical to the
+    'numpy' engine.
+
+    Parameters
+    ----------
+    quality_value : DataFrame
+        The quality value used to calculate quality adjustments.
+    to_reset : DataFrame
+        Boolean mask of quality adjustments to be reset.
+    to_adjust : DataFrame
+        Boolean mask of values to be adjusted.
+    workers : int, optional
+        The number of threads or processes. Defaults to the number of
+        CPUs.
+    executor : {'thread', 'process'}, default 'thread'
+        The numpy operations in the scan release the GIL, so threads
+        scale without copying the inputs. With 'process' the inputs
+        and output are copied once into shared memory, which the
+        workers attach to rather than having them pickled.
+    block_rows : int, optional
+        The number of rows in each block. Defaults to splitting the
+        rows evenly across the workers.
+    dtype : {float64, float32}, default float64
+        The dtype of the factors.
+
+    Returns
+    -------
+    DataFrame
+        Cumulative adjustment factors for base prices.
+
+    """
+    if executor not in ('thread', 'process'):
+        raise ValueError(
+            f"executor must be 'thread' or 'process', not {executor!r}"
+        )
+
+    workers = workers or os.cpu_count() or 1
+    n_rows = len(quality_value)
+    block_rows = block_rows or max(-(-n_rows // workers), 1)
+    blocks = [
+        (start, min(start + block_rows, n_rows))
+        for start in range(0, n_rows, block_rows)
+    ]
+
+    arrays = {
+        'values': quality_value.to_numpy(),
+        'out': np.empty(
+            quality_value.shape, dtype=_as_factor_dtype(dtype), order='F',
+        ),
+    }
+    if to_adjust is not None:
+        arrays['adjust'] = _mask_as_array(to_adjust, quality_value)
+    if to_reset is not None:
+        arrays['reset'] = _mask_as_array(to_reset, quality_value)
+
+    window = BasePeriodWindow(quality_value.columns, shifted=True)
+
+    if executor == 'thread':
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # Consume the results to raise any errors.
+            list(pool.map(
+                lambda block: _scan_block(arrays, window, *block), blocks,
+            ))
+        out = arrays['out']
+    else:
+        out = _run_in_processes(arrays, window, blocks, workers)
+
+    return pd.DataFrame(
+        out, index=quality_value.index, columns=quality_value.columns,
+        copy=False,
+    )
+
+
+def _run_in_processes(
+    arrays: Dict[str, np.ndarray],
+    window: BasePeriodWindow,
+    blocks: List[Tuple[int, int]],
+    workers: int,
+) -> np.ndarray:
+    """Run the blocks on a process pool, sharing arrays by shared memory."""
+    with ExitStack() as stack:
+        specs = {}
+        shared = {}
+        for name, arr in arrays.items():
+            shm = SharedMemory(create=True, size=max(arr.nbytes, 1))
+            stack.callback(shm.unlink)
+            stack.callback(shm.close)
+
+            shared[name] = _as_shared_array(shm, arr.shape, arr.dtype)
+            if name != 'out':
+                shared[name][...] = arr
+            specs[name] = (shm.name, arr.shape, arr.dtype.str)
+
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [
+                    pool.submit(_scan_shared_block, specs, window, start, stop)
+                    for start, stop in blocks
+                ]
+                for future in futures:
+                    future.result()
+
+            # Copy out before the shared memory is released.
+            out = arrays['out']
+            out[...] = shared['out']
+        finally:
+            # Views have to be dropped before the memory can be closed.
+            shared.clear()
+
+    return out
+
+
+def _scan_shared_block(
+    specs: Dict[str, SharedArraySpec],
+    window: BasePeriodWindow,
+    start: int,
+    stop: int,
+) -> None:
+    """Attach to the shared arrays and scan a block of rows."""
+    handles = [SharedMemory(name=shm_name) for shm_name, _, _ in specs.values()]
+    arrays = {}
+    try:
+        for shm, (name, (_, shape, dtype)) in zip(handles, specs.items()):
+            arrays[name] = _as_shared_array(shm, shape, dtype)
+        _scan_block(arrays, window, start, stop)
+    finally:
+        arrays.clear()
+        for shm in handles:
+            shm.close()
+
+
+def _scan_block(
+    arrays: Dict[str, np.ndarray],
+    window: BasePeriodWindow,
+    start: int,
+    stop: int,
+) -> None:
+    """Write the adjustment factors for rows start to stop to out."""
+    rows = slice(start, stop)
+    adjust, reset = arrays.get('adjust'), arrays.get('reset')
+    _scan_quality_adjustments(
+        arrays['values'][rows],
+        None if adjust is None else adjust[rows],
+        None if reset is None else reset[rows],
+        window,
+        arrays['out'][rows],
+    )
+
+
+def _as_shared_array(
+    shm: SharedMemory,
+    shape: Tuple[int, ...],
+    dtype: Any,
+) -> np.ndarray:
+    """Return an array backed by the shared memory block."""
+    # The output is column major, as in the 'numpy' engine.
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf, order='F')
@@ -0,0 +1,303 @@
+"""Tests for converting CSVs to tuple text data with csv_to_text."""
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pandas._testing import assert_frame_equal
+import pytest
+
+from .helpers import create_dataframe, load_fixture
+
+import csv_to_text
+
+
+@pytest.fixture
+def csv_file(tmp_path, monkeypatch):
+    """Return a small CSV of prices, with TXTs written to tmp_path."""
+    monkeypatch.setattr(csv_to_text, 'TXT_DIR', str(tmp_path))
+
+    filename = tmp_path / 'prices.csv'
+    filename.write_text(
+        'month,group,price\n'
+        '01/01/2017,a,1.5\n'
+        '01/01/2017,b,2.0\n'
+        '01/02/2017,a,1.75\n'
+        '01/02/2017,b,2.25\n'
+    )
+    return str(filename)
+
+
+@pytest.fixture
+def hashed_files(monkeypatch):
+    """Record the files hashed by csv_to_text."""
+    hashed = []
+    hash_file = csv_to_text._hash_file
+
+    def record_hash(filename):
+        hashed.append(filename)
+        return hash_file(filename)
+
+    monkeypatch.setattr(csv_to_text, '_hash_file', record_hash)
+    return hashed
+
+
+class TestManifest:
+    """Tests unchanged CSVs are skipped using the manifest."""
+
+    def test_rerun_only_converts_changed_csvs(self, tmp_path, csv_file, hashed_files):
+        """A rerun hashes nothing, and an edited CSV is converted again."""
+        manifest = str(tmp_path / 'manifest.json')
+        txt_file = str(tmp_path / 'prices.txt')
+
+        results = csv_to_text.convert_all_csvs([csv_file], manifest=manifest)
+        assert [(r.skipped, r.error) for r in results] == [(False, None)]
+        first_txt = open(txt_file).read()
+
+        # A rerun with nothing changed only looks at the file stats.
+        hashed_files.clear()
+        results = csv_to_text.convert_all_csvs([csv_file], manifest=manifest)
+        assert results[0].skipped
+        assert hashed_files == []
+
+        # A touched CSV is hashed once, then its new stats are recorded.
+        stat = os.stat(csv_file)
+        os.utime(csv_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        results = csv_to_text.convert_all_csvs([csv_file], manifest=manifest)
+        assert results[0].skipped
+        assert hashed_files == [csv_file]
+
+        hashed_files.clear()
+        csv_to_text.convert_all_csvs([csv_file], manifest=manifest)
+        assert hashed_files == []
+
+        # An edited CSV is converted again.
+        with open(csv_file, 'a') as f:
+            f.write('01/03/2017,a,2.5\n01/03/2017,b,3.0\n')
+        results = csv_to_text.convert_all_csvs([csv_file], manifest=manifest)
+        assert not results[0].skipped
+        assert open(txt_file).read() != first_txt
+
+    def test_rerun_with_partial_date_parser(self, tmp_path, csv_file):
+        """A partial parser gives the same fingerprint in a new process."""
+        # Only the month column is passed to the parser with pyarrow.
+        pytest.importorskip('pyarrow')
+        manifest = str(tmp_path / 'manifest.json')
+        convert = (
+            "csv_to_text.convert_all_csvs("
+            f"[{csv_file!r}], "
+            "date_parser=partial(pd.to_datetime, dayfirst=True), "
+            f"manifest={manifest!r}, "
+            "load_options={'engine': 'pyarrow'})"
+        )
+
+        outputs = [
+            subprocess.run(
+                [
+                    sys.executable, '-c',
+                    "from functools import partial; import pandas as pd; "
+                    "import csv_to_text; "
+                    f"csv_to_text.TXT_DIR = {str(tmp_path)!r}; " + convert,
+                ],
+                cwd=os.path.dirname(csv_to_text.__file__),
+                capture_output=True, text=True, check=True,
+            ).stdout
+            for _ in range(2)
+        ]
+
+        assert "Converted 1 of 1 files (0 up to date)." in outputs[0]
+        assert "Converted 0 of 1 files (1 up to date)." in outputs[1]
+
+    def test_edited_npz_converted_again(self, tmp_path, csv_file, capsys):
+        """An edited .npz is reported as stale and written again."""
+        manifest = str(tmp_path / 'manifest.json')
+        npz_file = str(tmp_path / 'prices.npz')
+        csv_to_text.convert_all_csvs([csv_file], manifest=manifest, binary=True)
+        assert csv_to_text.convert_all_csvs(
+            [csv_file], manifest=manifest, binary=True,
+        )[0].skipped
+
+        with open(npz_file, 'ab') as f:
+            f.write(b'edited')
+        capsys.readouterr()
+        results = csv_to_text.convert_all_csvs(
+            [csv_file], manifest=manifest, binary=True,
+        )
+
+        assert not results[0].skipped
+        assert f"Stale: {npz_file}" in capsys.readouterr().out
+        load_fixture(npz_file)
+
+    def test_removed_csv_reported_once(self, tmp_path, csv_file, capsys):
+        """The TXT of a removed CSV is reported as stale on one run only."""
+        manifest = str(tmp_path / 'manifest.json')
+        csv_to_text.convert_all_csvs([csv_file], manifest=manifest)
+
+        os.remove(csv_file)
+        capsys.readouterr()
+        csv_to_text.convert_all_csvs([], manifest=manifest)
+        assert 'Stale' in capsys.readouterr().out
+
+        csv_to_text.convert_all_csvs([], manifest=manifest)
+        assert 'Stale' not in capsys.readouterr().out
+
+
+class TestLoad:
+    """Tests the options for loading a CSV."""
+
+    @pytest.mark.parametrize(
+        "load_options",
+        [
+            {'date_format': '%d/%m/%Y'},
+            {'engine': 'python'},
+            {'engine': 'pyarrow'},
+            {'engine': 'pyarrow', 'date_format': '%d/%m/%Y'},
+        ],
+        ids=["date_format", "python", "pyarrow", "pyarrow_date_format"],
+    )
+    def test_matches_default(self, csv_file, load_options):
+        """Each option loads the same DataFrame as the default."""
+        if load_options.get('engine') == 'pyarrow':
+            pytest.importorskip('pyarrow')
+
+        assert_frame_equal(
+            csv_to_text._load(csv_file, **load_options),
+            csv_to_text._load(csv_file),
+        )
+
+    def test_date_parser_and_date_format_rejected(self, csv_file):
+        """Passing both ways of converting the months raises."""
+        with pytest.raises(ValueError, match="Only one of"):
+            csv_to_text._load(
+                csv_file, date_parser=pd.to_datetime, date_format='%d/%m/%Y',
+            )
+
+
+class TestTupleText:
+    """Tests the tuple text is written as it was from itertuples."""
+
+    @pytest.fixture
+    def frames(self):
+        """Return frames with values that repr in different ways."""
+        months = pd.date_range('2017-01-01', periods=5, freq='MS', name='month')
+        stamps = pd.to_datetime([
+            '2017-01-01', '2017-01-01 12:30:15', None,
+            '2017-01-01 00:00:00.5', '2017-01-01 00:00:00.000000001',
+        ])
+        return [
+            pd.DataFrame(
+                {
+                    ('price', 'a'): [1.5, np.nan, 2.0, 1e-09, -0.0],
+                    ('price', 'b'): ['x', None, 'y', 'z', 'w'],
+                    ('count', 'a'): [1, 2, 3, 4, 5],
+                    ('stamp', 'a'): stamps,
+                    ('stamp', 'b'): stamps.tz_localize('Europe/London'),
+                    ('stamp', 'c'): months.rename(None),
+                },
+                index=months,
+            ),
+            # Without a freq on the index, and no other columns.
+            pd.DataFrame(index=pd.Index(stamps, name='month')),
+        ]
+
+    @pytest.mark.parametrize("chunksize", [1, 2, 10])
+    def test_matches_itertuples(self, tmp_path, monkeypatch, frames, chunksize):
+        """The TXT is the same as writing str() of each itertuples row."""
+        monkeypatch.setattr(csv_to_text, 'preprocess', lambda df: df)
+        filename = str(tmp_path / 'prices.txt')
+
+        for df in frames:
+            csv_to_text._generate_test_data(df, filename, chunksize)
+
+            headers = (df.index.name,) + tuple(df.columns)
+            expected = str(headers) + ',\n' + '\n'.join(
+                str(t) + ',' for t in df.itertuples(index=True, name=None)
+            )
+            assert open(filename).read() == expected
+
+
+class TestWorkers:
+    """Tests converting in parallel gives the same as one by one."""
+
+    def test_workers_match_serial(self, tmp_path, csv_file, monkeypatch):
+        """The TXTs and errors are the same with one or two workers."""
+        other_file = tmp_path / 'other.csv'
+        other_file.write_text(
+            'month,group,price\n'
+            '01/03/2017,c,3.5\n'
+            '01/04/2017,c,4.0\n'
+        )
+        # No group column, so it fails to load.
+        bad_file = tmp_path / 'bad.csv'
+        bad_file.write_text('month,price\n01/01/2017,1.5\n')
+        files = [csv_file, str(bad_file), str(other_file)]
+
+        outputs = []
+        for workers in [1, 2]:
+            txt_dir = tmp_path / f'workers_{workers}'
+            txt_dir.mkdir()
+            monkeypatch.setattr(csv_to_text, 'TXT_DIR', str(txt_dir))
+
+            results = csv_to_text.convert_all_csvs(files, workers=workers)
+
+            txts = {
+                Path(r.txt_file).name: Path(r.txt_file).read_bytes()
+                for r in results if r.error is None
+            }
+            outputs.append((txts, [r.error for r in results]))
+
+        assert outputs[0] == outputs[1]
+        txts, errors = outputs[0]
+        assert sorted(txts) == ['other.txt', 'prices.txt']
+        assert [error is None for error in errors] == [True, False, True]
+
+
+class TestBinaryFixture:
+    """Tests the .npz fixture loads the same as the tuple text."""
+
+    @pytest.mark.parametrize(
+        "groups",
+        [
+            ['a', 'b'],
+            [pd.Timestamp('2017-01-01'), pd.Timestamp('2017-02-01')],
+            [1.0, np.nan],
+        ],
+        ids=["strings", "timestamps", "with_nan"],
+    )
+    def test_load_fixture_matches_tuple_text(self, tmp_path, groups):
+        """load_fixture gives the DataFrame made from the tuple text."""
+        df = pd.DataFrame(
+            {'price': [1.5, 2.0, 1.75, np.nan]},
+            index=pd.MultiIndex.from_product(
+                [pd.to_datetime(['2017-01-01', '2017-02-01']), groups],
+                names=['month', 'group'],
+            ),
+        )
+        txt_file = str(tmp_path / 'prices.txt')
+        npz_file = str(tmp_path / 'prices.npz')
+
+        csv_to_text._generate_test_data(df, txt_file)
+        csv_to_text._generate_binary_data(df, npz_file)
+
+        # The tuple text is pasted into a test module as a list.
+        with open(txt_file) as f:
+            tuple_data = eval(
+                '[' + f.read() + ']', {'Timestamp': pd.Timestamp, 'nan': np.nan},
+            )
+
+        assert_frame_equal(load_fixture(npz_file), create_dataframe(tuple_data))
+
+    def test_unsupported_header_rejected(self, tmp_path):
+        """Labels that can't be stored without pickle fail when written."""
+        df = pd.DataFrame(
+            {'price': [1.5, 2.0]},
+            index=pd.MultiIndex.from_tuples(
+                [(pd.Timestamp('2017-01-01'), 'a'), (pd.Timestamp('2017-01-01'), None)],
+                names=['month', 'group'],
+            ),
+        )
+
+        with pytest.raises(TypeError, match="column labels"):
+            csv_to_text._generate_binary_data(df, str(tmp_path / 'prices.npz'))
@@ -1,11 +1,20 @@
-from typing import Optional, Any, Tuple, Dict
+from functools import lru_cache
+from typing import (
+    Optional, Any, Tuple, Dict, Hashable, Iterable, Iterator, List,
+    Mapping, MutableMapping, Sequence, Union,
+)
 
+import numpy as np
 import pytest
 import pandas as pd
 
 class Case:
     """Container for a test case, with optional test ID.
 
+    The parameter names are kept as a sorted tuple shared by every
+    Case with the same names, and the values as a tuple in the same
+    order, so many generated cases stay small.
+
     Attributes
     ----------
         label : str
@@ -24,27 +33,291 @@ class Case:
 
     """
 
+    __slots__ = ('label', '_keys', '_values')
+
+    # The sorted parameter names seen so far, shared between cases.
+    _shared_keys: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+
     def __init__(self, label: Optional[str] = None, **kwargs):
         """Initialise objects."""
+        keys = tuple(sorted(kwargs))
         self.label = label
-        self.kwargs = kwargs
-        # Makes kwargs accessible with dot notation.
-        self.__dict__.update(kwargs)
+        self._keys = self._shared_keys.setdefault(keys, keys)
+        self._values = tuple(kwargs[k] for k in keys)
+
+    @property
+    def kwargs(self) -> Dict[str, Any]:
+        """Return the parameters as a dict."""
+        return dict(zip(self._keys, self._values))
+
+    def __getattr__(self, name: str) -> Any:
+        """Makes kwargs accessible with dot notation."""
+        # Only called for names that aren't slots, so this is never
+        # reached for _keys itself unless it isn't set yet.
+        if name in Case.__slots__:
+            raise AttributeError(name)
+        try:
+            return self._values[self._keys.index(name)]
+        except ValueError:
+            raise AttributeError(
+                f"{type(self).__name__!r} object has no attribute {name!r}"
+            ) from None
 
     def __repr__(self) -> str:
         """Return string."""
         return f"Case({self.label!r}, **{self.kwargs!r})"
 
 
-def create_dataframe(tuple_data):
-    """Create pandas df from tuple data with a header."""
-    return pd.DataFrame.from_records(tuple_data[1:], columns=tuple_data[0])
+def create_dataframe(
+    tuple_data: Sequence[Tuple[Any, ...]],
+    dtypes: Optional[Union[Any, Mapping[Hashable, Any]]] = None,
+    date_columns: bool = False,
+    cached: bool = False,
+) -> pd.DataFrame:
+    """Create pandas df from tuple data with a header.
+
+    Parameters
+    ----------
+    tuple_data: sequence of tuple
+        The header followed by the rows.
+    dtypes: dtype or dict, optional
+        The dtype for every column, or a mapping of header labels to
+        dtypes for some of them. This skips the dtype inference that
+        from_records does value by value, which is much faster for
+        large data. Columns left out are inferred as from_records does.
+    date_columns: bool, default False
+        Convert the header labels to dates, the same as setting
+        df.columns = pd.to_datetime(df.columns, dayfirst=True).
+    cached: bool, default False
+        Reuse the frame from an earlier call with the same arguments.
+        The values are shared so are read-only, but each call gets a
+        shallow copy with its own axes, so they can be set or renamed.
+
+    """
+    if cached:
+        # The value types are part of the key since True == 1 == 1.0,
+        # which would otherwise give a bool fixture the cached ints.
+        key = (
+            tuple(tuple_data),
+            tuple(tuple(type(v) for v in row) for row in tuple_data),
+            _freeze_dtypes(dtypes),
+            date_columns,
+        )
+        df = _create_cached_dataframe(key).copy(deep=False)
+        # Views of the axes, so setting a name doesn't change the cache.
+        df.index, df.columns = df.index.view(), df.columns.view()
+        return df
+
+    return _create_dataframe(tuple_data, dtypes, date_columns)
+
+
+def cached_dataframe(
+    tuple_data: Sequence[Tuple[Any, ...]],
+    dtypes: Optional[Union[Any, Mapping[Hashable, Any]]] = None,
+    date_columns: bool = False,
+) -> pd.DataFrame:
+    """Return a copy of a DataFrame built once per session from tuple data.
+
+    Use in fixtures in place of create_dataframe. The frame is built the
+    first time the tuple data is seen and each call after gets a copy,
+    so a test that changes its input can't affect any other test. See
+    create_dataframe for the parameters.
+    """
+    return create_dataframe(
+        tuple_data, dtypes, date_columns, cached=True,
+    ).copy()
+
+
+def _create_dataframe(
+    tuple_data: Sequence[Tuple[Any, ...]],
+    dtypes: Optional[Union[Any, Mapping[Hashable, Any]]],
+    date_columns: bool,
+) -> pd.DataFrame:
+    """Create the DataFrame for create_dataframe."""
+    header, rows = tuple_data[0], tuple_data[1:]
+
+    if dtypes is None:
+        df = pd.DataFrame.from_records(rows, columns=header)
+
+    elif (
+        not isinstance(dtypes, Mapping)
+        and isinstance(pd.api.types.pandas_dtype(dtypes), np.dtype)
+    ):
+        # A single numpy dtype converts all the rows in one go.
+        values = np.array(rows, dtype=dtypes).reshape(len(rows), len(header))
+        df = pd.DataFrame(values, columns=list(header))
+
+    else:
+        # Transpose the rows once into an object array, then convert
+        # each column from a view of it.
+        values = np.array(rows, dtype=object).reshape(len(rows), len(header))
+        columns = {}
+        for j, label in enumerate(header):
+            dtype = dtypes.get(label) if isinstance(dtypes, Mapping) else dtypes
+            column = pd.Series(values[:, j], copy=False)
+            columns[j] = (
+                column.infer_objects() if dtype is None
+                else column.astype(dtype)
+            )
+
+        df = pd.DataFrame(columns)
+        df.columns = pd.Index(list(header))
+
+    if date_columns:
+        # Copied so each frame has its own columns to rename.
+        df.columns = _parse_date_columns(tuple(header)).copy()
+
+    return df
 
 
-def get_case_parameters(request: pytest.FixtureRequest) -> Dict[str, Any]:
-    """Return the parameters for each test case from the fixture reqest."""
+@lru_cache(maxsize=None)
+def _create_cached_dataframe(key: Tuple[Any, ...]) -> pd.DataFrame:
+    """Create a DataFrame with read-only values to share across calls."""
+    tuple_data, _, dtypes, date_columns = key
+    if isinstance(dtypes, tuple):
+        dtypes = dict(dtypes)
+
+    df = _create_dataframe(tuple_data, dtypes, date_columns)
+    for arr in df._mgr.arrays:
+        # Datetime values are held in an array wrapping the ndarray.
+        arr = getattr(arr, '_ndarray', arr)
+        if isinstance(arr, np.ndarray):
+            arr.flags.writeable = False
+
+    return df
+
+
+@lru_cache(maxsize=128)
+def _parse_date_columns(header: Tuple[Any, ...]) -> pd.DatetimeIndex:
+    """Return the header labels as dates, parsed once for each header."""
+    return pd.to_datetime(pd.Index(list(header)), dayfirst=True)
+
+
+def _freeze_dtypes(dtypes: Any) -> Hashable:
+    """Return dtypes in a hashable form for the cache key."""
+    if isinstance(dtypes, Mapping):
+        return tuple(dtypes.items())
+    return dtypes
+
+
+def load_fixture(filename: str) -> pd.DataFrame:
+    """Load a binary fixture written by csv_to_text.
+
+    Returns the same DataFrame as create_dataframe does for the tuple
+    text data of the same file, without compiling the tuples. The .npz
+    members are compressed so are read into memory rather than
+    memory-mapped.
+    """
+    with np.load(filename, allow_pickle=False) as data:
+        n_levels = sum(f.startswith('header_level_') for f in data.files)
+        levels = [_as_labels(data[f'header_level_{k}']) for k in range(n_levels)]
+        # Column labels with more than one level are tuples in the text.
+        labels = levels[0] if n_levels == 1 else list(zip(*levels))
+        headers = _as_labels(data['header_index']) + labels
+        columns = [
+            _as_record_dtype(data[f'column_{i}']) for i in range(len(headers))
+        ]
+
+    df = pd.DataFrame(dict(enumerate(columns)))
+    df.columns = pd.Index(list(headers))
+    return df
+
+
+def _as_labels(arr: np.ndarray) -> List[Any]:
+    """Return the stored labels as the scalars in a tuple text header."""
+    # The Index gives Timestamps for datetimes rather than ints, and
+    # NaN is np.nan so labels holding it compare equal as in the text.
+    return [
+        np.nan if isinstance(v, float) and np.isnan(v) else v
+        for v in pd.Index(arr).tolist()
+    ]
+
+
+def _as_record_dtype(arr: np.ndarray) -> np.ndarray:
+    """Cast to the dtype from_records infers from the Python values."""
+    if arr.dtype.kind == 'U':
+        return arr.astype(object)
+    elif arr.dtype.kind == 'f':
+        return arr.astype(np.float64, copy=False)
+    elif arr.dtype.kind in 'iu':
+        return arr.astype(np.int64, copy=False)
+    elif arr.dtype.kind == 'M':
+        return arr.astype('datetime64[ns]', copy=False)
+    return arr
+
+
+class FixtureRef:
+    """A reference to a fixture by name, for use as a Case parameter.
+
+    get_case_parameters only looks up the parameters given as a
+    FixtureRef, any other value is passed to the test as it is.
+
+    Examples
+    --------
+    >>> Case(label="some test name", expout=FixtureRef("expout_fixture"))
+
+    """
+
+    __slots__ = ('name',)
+
+    def __init__(self, name: str):
+        """Initialise objects."""
+        self.name = name
+
+    def __repr__(self) -> str:
+        """Return string."""
+        return f"FixtureRef({self.name!r})"
+
+
+class CaseParameters(MutableMapping[str, Any]):
+    """The parameters of a test case, with fixtures resolved lazily.
+
+    A FixtureRef is only resolved with request.getfixturevalue when
+    the test reads the parameter, and the value is kept for the rest
+    of the test.
+    """
+
+    def __init__(self, request: pytest.FixtureRequest, kwargs: Dict[str, Any]):
+        """Initialise objects."""
+        self._request = request
+        self._values = dict(kwargs)
+
+    def __getitem__(self, key: str) -> Any:
+        """Return the parameter, resolving it if it is a fixture."""
+        value = self._values[key]
+        if isinstance(value, FixtureRef):
+            value = self._request.getfixturevalue(value.name)
+            self._values[key] = value
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        """Set the parameter."""
+        self._values[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        """Remove the parameter."""
+        del self._values[key]
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the parameter names."""
+        return iter(self._values)
+
+    def __len__(self) -> int:
+        """Return the number of parameters."""
+        return len(self._values)
+
+    def __repr__(self) -> str:
+        """Return string."""
+        return f"CaseParameters({self._values!r})"
+
+
+def get_case_parameters(request: pytest.FixtureRequest) -> CaseParameters:
+    """Return the parameters for each test case from the fixture reqest.
+
+    Parameters given as a FixtureRef are resolved when first read.
+    """
     case = request.param
-    return {k: get_fixture_value(request, v) for k, v in case.kwargs.items()}
+    return CaseParameters(request, case.kwargs)
 
 
 def slice_dataframes(
@@ -64,45 +337,96 @@ def slice_dataframes(
     return tuple([df.loc[slice_, :] for df in dfs])
 
 
-def get_fixture_value(request: pytest.FixtureRequest, v: Any) -> Any:
-    """Get the fixture value if it is a fixture, else v."""
-    try:
-        return request.getfixturevalue(v)
-    except (pytest.FixtureLookupError, TypeError):
-        return v
+def islice_dataframes(
+    ranges: Union[Tuple[int, int], Sequence[Tuple[int, int]]],
+    *dfs: pd.DataFrame,
+) -> Union[Tuple[pd.DataFrame, ...], List[Tuple[pd.DataFrame, ...]]]:
+    """Slice each DataFrame by row position, inclusive of the end.
+
+    The positional version of slice_dataframes. The bounds are checked
+    once for all the frames, and the slices are iloc views where
+    pandas allows, so one large input and expected output pair can be
+    split into many cases without copying.
+
+    Parameters
+    ----------
+    ranges: tuple of int or sequence of tuple
+        The (start, end) row positions, or a sequence of them to slice
+        the frames by each in one go.
+    *dfs: DataFrame
+        The frames to slice.
+
+    Returns
+    -------
+    tuple of DataFrame, or list of tuple of DataFrame
+        The sliced frames, or a tuple of them for each range if given a
+        sequence of ranges.
+
+    """
+    single = len(ranges) == 2 and all(
+        isinstance(i, (int, np.integer)) for i in ranges
+    )
+    bounds = np.array([ranges] if single else ranges, dtype=np.int64)
+    bounds = bounds.reshape(-1, 2)
+
+    n_rows = min(len(df) for df in dfs)
+    invalid = (bounds[:, 0] < 0) | (bounds[:, 0] > bounds[:, 1])
+    if invalid.any():
+        raise IndexError(f"Invalid slice range: {tuple(bounds[invalid][0])}")
+
+    if (bounds[:, 1] >= n_rows).any():
+        raise IndexError(
+            "Slice end is not in range of the rows: "
+            f"{bounds[:, 1].max()} > {n_rows - 1}"
+        )
+
+    sliced = [
+        tuple(df.iloc[start:end + 1] for df in dfs)
+        for start, end in bounds.tolist()
+    ]
+    return sliced[0] if single else sliced
 
 
-def parametrize_cases(*cases: Case):
+def parametrize_cases(*cases: Union[Case, Iterable[Case]]):
     """More user friendly parameterize cases testing.
 
+    Takes the cases as arguments, or a single iterable such as a
+    generator of cases, which is only gone through once.
+
     Source: https://github.com/ckp95/pytest-parametrize-cases
     """
-    for case in cases:
-        if not isinstance(case, Case):
-            raise TypeError(f"{case!r} is not an instance of Case")
-
-    first_case = cases[0]
-    first_args = first_case.kwargs.keys()
-    argument_string = ",".join(sorted(first_args))
+    if len(cases) == 1 and not isinstance(cases[0], Case):
+        cases = cases[0]
 
+    first_case = None
     case_list = []
     ids_list = []
     for case in cases:
-        args = case.kwargs.keys()
+        if not isinstance(case, Case):
+            raise TypeError(f"{case!r} is not an instance of Case")
 
-        if args != first_args:
+        if first_case is None:
+            first_case = case
+        # Cases with the same names share the keys tuple, so the
+        # comparison is only needed for copied cases.
+        elif (
+            case._keys is not first_case._keys
+            and case._keys != first_case._keys
+        ):
             raise ValueError(
                 f"Inconsistent signature: {first_case!r}, {case!r}"
             )
 
-        case_tuple = tuple(value for key, value in sorted(case.kwargs.items()))
-        case_list.append(case_tuple)
+        case_list.append(case._values)
         ids_list.append(case.label)
 
-    if len(first_args) == 1:
+    if first_case is None:
+        raise ValueError("No cases given")
+
+    if len(first_case._keys) == 1:
         # otherwise it gets passed to the test function as a singleton tuple
         case_list = [i[0] for i in case_list]
 
     return pytest.mark.parametrize(
-        argnames=argument_string, argvalues=case_list, ids=ids_list
+        argnames=",".join(first_case._keys), argvalues=case_list, ids=ids_list
     )
@@ -1,15 +1,27 @@
 """ """
+import importlib
+
+import numpy as np
 import pandas as pd
-from pandas._testing import assert_frame_equal
+from pandas._testing import assert_frame_equal, assert_series_equal
 import pytest
 
 from .helpers import (
     Case,
-    create_dataframe,
+    CaseParameters,
+    FixtureRef,
+    cached_dataframe,
     get_case_parameters,
 )
 
-from src.kwargs_quality_adjustment import get_quality_adjustments
+from src import kernels
+from src.base_period import BasePeriodWindow
+from src.kwargs_quality_adjustment import (
+    IncrementalQualityAdjuster,
+    get_cumulative_adjustments,
+    get_quality_adjustments,
+)
+from src.quality_adjustment_parallel import get_quality_adjustments_parallel
 
 class TestGetQualityAdjustments:
     """Tests for get_quality_adjustments function."""
@@ -21,7 +33,7 @@ class TestGetQualityAdjustments:
         The important feature of this dataset is that it spans multiple
         years, as the function fills within the year.
         """
-        df = create_dataframe([
+        return cached_dataframe([
             (   # columns
                 '01/01/2017', '01/02/2017', '01/03/2017', '01/04/2017', '01/05/2017', '01/06/2017',
                 '01/07/2017', '01/08/2017', '01/09/2017', '01/10/2017', '01/11/2017', '01/12/2017',
@@ -32,14 +44,12 @@ class TestGetQualityAdjustments:
             (10, 10, 10, 10, 10, 10, 10, 10, 10, 10, 10, 10, 10, 10, 10),
             (1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 2, 2, 2, 2),
             (10, 11, 11, 11, 11, 11, 12, 12, 12, 12, 14, 14, 13, 13, 13),
-        ])
-        df.columns = pd.to_datetime(df.columns, dayfirst=True)
-        return df
+        ], date_columns=True)
 
     @pytest.fixture
     def expout_all_size_changes_true(self):
         """Return the expected output data for when no to_adjust or to_reset are passed."""
-        df = create_dataframe([
+        return cached_dataframe([
             (   # columns
                 '01/01/2017', '01/02/2017', '01/03/2017', '01/04/2017', '01/05/2017', '01/06/2017',
                 '01/07/2017', '01/08/2017', '01/09/2017', '01/10/2017', '01/11/2017', '01/12/2017',
@@ -53,9 +63,7 @@ class TestGetQualityAdjustments:
             (1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1),
             (1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 2, 2, 1, 1),
             (1, 1.1, 1.1, 1.1, 1.1, 1.1, 1.2, 1.2, 1.2, 1.2, 1.4, 1.4, 1.3, 1, 1),
-        ])
-        df.columns = pd.to_datetime(df.columns, dayfirst=True)
-        return df.astype('float64')
+        ], dtypes='float64', date_columns=True)
 
     @pytest.fixture
     def to_adjust_only_selected_size_changes_true(self):
@@ -65,7 +73,7 @@ class TestGetQualityAdjustments:
         mimics the W codes mask, as not all size changes are marked
         with a W code.
         """
-        df = create_dataframe([
+        return cached_dataframe([
             (
                 '01/01/2017', '01/02/2017', '01/03/2017', '01/04/2017', '01/05/2017', '01/06/2017',
                 '01/07/2017', '01/08/2017', '01/09/2017', '01/10/2017', '01/11/2017', '01/12/2017',
@@ -76,16 +84,14 @@ class TestGetQualityAdjustments:
             (False, False, False, False, False, False, False, False, False, False, False, False, False, False, False),
             (False, False, False, False, False, False, False, False, False, False, False, True, False, False, False),
             (False, True, False, False, False, False, True, False, False, False, True, False, True, False, False),
-        ])
-        df.columns = pd.to_datetime(df.columns, dayfirst=True)
-        return df
+        ], date_columns=True)
 
     @pytest.fixture
     def expout_only_selected_size_changes_true(self):
         """Return the expected output data for when only selected size
         changes are true, given by to_adjust.
         """
-        df = create_dataframe([
+        return cached_dataframe([
             (
                 '01/01/2017', '01/02/2017', '01/03/2017', '01/04/2017', '01/05/2017', '01/06/2017',
                 '01/07/2017', '01/08/2017', '01/09/2017', '01/10/2017', '01/11/2017', '01/12/2017',
@@ -99,14 +105,12 @@ class TestGetQualityAdjustments:
             (1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1),
             (1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 2, 2, 1, 1),
             (1, 1.1, 1.1, 1.1, 1.1, 1.1, 1.2, 1.2, 1.2, 1.2, 1.4, 1.4, 1.3, 1, 1),
-        ])
-        df.columns = pd.to_datetime(df.columns, dayfirst=True)
-        return df.astype('float64')
+        ], dtypes='float64', date_columns=True)
 
     @pytest.fixture
     def to_reset(self):
         """Return the to_reset bool mask input data."""
-        df = create_dataframe([
+        return cached_dataframe([
             (
                 '01/01/2017', '01/02/2017', '01/03/2017', '01/04/2017', '01/05/2017', '01/06/2017',
                 '01/07/2017', '01/08/2017', '01/09/2017', '01/10/2017', '01/11/2017', '01/12/2017',
@@ -117,16 +121,14 @@ class TestGetQualityAdjustments:
             (False, False, False, False, False, False, False, False, False, False, False, False, False, False, False),
             (False, False, False, False, False, False, False, False, False, False, False, False, False, False, False),
             (False, False, False, True, False, False, False, False, False, False, False, False, False, False, False),
-        ])
-        df.columns = pd.to_datetime(df.columns, dayfirst=True)
-        return df
+        ], date_columns=True)
 
     @pytest.fixture
     def expout_all_size_changes_true_with_imputations(self):
         """Return the expected output data for when all size changes are true
         and a set of imputations are passed.
         """
-        df = create_dataframe([
+        return cached_dataframe([
             (   # columns
                 '01/01/2017', '01/02/2017', '01/03/2017', '01/04/2017', '01/05/2017', '01/06/2017',
                 '01/07/2017', '01/08/2017', '01/09/2017', '01/10/2017', '01/11/2017', '01/12/2017',
@@ -143,16 +145,14 @@ class TestGetQualityAdjustments:
                 1, 1.1, 1.1, 1, 1, 1, 1.0909091, 1.0909091, 1.0909091, 1.0909091,
                 1.2727273, 1.2727273, 1.1818182, 1, 1,
             ),
-        ])
-        df.columns = pd.to_datetime(df.columns, dayfirst=True)
-        return df.astype('float64')
+        ], dtypes='float64', date_columns=True)
 
     @pytest.fixture
     def expout_only_selected_size_changes_true_with_imputations(self):
         """Return the expected output data for when only selected size changes
         are true and a set of imputations are passed.
         """
-        df = create_dataframe([
+        return cached_dataframe([
             (   # columns
                 '01/01/2017', '01/02/2017', '01/03/2017', '01/04/2017', '01/05/2017', '01/06/2017',
                 '01/07/2017', '01/08/2017', '01/09/2017', '01/10/2017', '01/11/2017', '01/12/2017',
@@ -169,31 +169,29 @@ class TestGetQualityAdjustments:
                 1, 1.1, 1.1, 1, 1, 1, 1.0909091, 1.0909091, 1.0909091, 1.0909091,
                 1.2727273, 1.2727273, 1.1818182, 1, 1,
             ),
-        ])
-        df.columns = pd.to_datetime(df.columns, dayfirst=True)
-        return df.astype('float64')
+        ], dtypes='float64', date_columns=True)
 
     @pytest.fixture(
         params=[
             Case(
                 label="just_sizes",
-                expout="expout_all_size_changes_true",
+                expout=FixtureRef("expout_all_size_changes_true"),
             ),
             Case(
                 label="sizes_with_to_adjust",
-                to_adjust="to_adjust_only_selected_size_changes_true",
-                expout="expout_only_selected_size_changes_true",
+                to_adjust=FixtureRef("to_adjust_only_selected_size_changes_true"),
+                expout=FixtureRef("expout_only_selected_size_changes_true"),
             ),
             Case(
                 label="sizes_with_to_reset",
-                to_reset="to_reset",
-                expout="expout_all_size_changes_true_with_imputations",
+                to_reset=FixtureRef("to_reset"),
+                expout=FixtureRef("expout_all_size_changes_true_with_imputations"),
             ),
             Case(
                 label="size_with_to_adjust_and_to_reset",
-                to_reset="to_reset",
-                to_adjust="to_adjust_only_selected_size_changes_true",
-                expout="expout_only_selected_size_changes_true_with_imputations",
+                to_reset=FixtureRef("to_reset"),
+                to_adjust=FixtureRef("to_adjust_only_selected_size_changes_true"),
+                expout=FixtureRef("expout_only_selected_size_changes_true_with_imputations"),
             ),
         ],
         ids=lambda x: x.label,
@@ -202,14 +200,307 @@ class TestGetQualityAdjustments:
         """Return the parameters for each test given by params."""
         return get_case_parameters(request)
 
+    @pytest.mark.parametrize("engine", ["pandas", "numpy"])
     def test_selected_size_changes(
         self,
         input_quality_values,
         case_parameters,
+        engine,
     ):
         """Unit tests for get_quality_adjustments."""
         expected_output = case_parameters.pop('expout')
 
-        output = get_quality_adjustments(input_quality_values, **case_parameters)
+        output = get_quality_adjustments(
+            input_quality_values,
+            **case_parameters,
+            engine=engine,
+        )
 
         assert_frame_equal(output, expected_output)
+
+    def test_float32_into_out(self, input_quality_values, case_parameters):
+        """float32 factors written to out are close to float64."""
+        case_parameters.pop('expout')
+        expected_output = get_quality_adjustments(
+            input_quality_values, **case_parameters, engine='numpy',
+        )
+        out = np.empty(input_quality_values.shape, dtype=np.float32, order='F')
+
+        output = get_quality_adjustments(
+            input_quality_values,
+            **case_parameters,
+            engine='numpy',
+            dtype='float32',
+            out=out,
+        )
+
+        assert np.shares_memory(output.to_numpy(), out)
+        assert_frame_equal(
+            output, expected_output, check_dtype=False, check_exact=False,
+            rtol=1e-5,
+        )
+
+    @pytest.mark.parametrize("executor", ["thread", "process"])
+    def test_parallel_matches_numpy(
+        self,
+        input_quality_values,
+        case_parameters,
+        executor,
+    ):
+        """Running blocks of rows in parallel gives the same output."""
+        case_parameters.pop('expout')
+        expected_output = get_quality_adjustments(
+            input_quality_values, **case_parameters, engine='numpy',
+        )
+
+        output = get_quality_adjustments_parallel(
+            input_quality_values,
+            **case_parameters,
+            workers=2,
+            executor=executor,
+            block_rows=2,
+        )
+
+        assert_frame_equal(output, expected_output, check_exact=True)
+
+    def test_incremental_matches_full(self, input_quality_values, case_parameters):
+        """Updating a period at a time gives the full recomputation."""
+        expected_output = case_parameters.pop('expout')
+
+        adjuster = IncrementalQualityAdjuster(input_quality_values.index)
+        output = pd.concat(
+            [
+                adjuster.update(
+                    period,
+                    input_quality_values[period],
+                    **{k: v[period] for k, v in case_parameters.items()},
+                )
+                for period in input_quality_values.columns
+            ],
+            axis=1,
+        )
+
+        assert_frame_equal(output, expected_output, check_names=False)
+
+        # The state can also be built from the history in one go.
+        history = IncrementalQualityAdjuster.from_history(
+            input_quality_values, **case_parameters,
+        )
+        assert_series_equal(
+            history.update(
+                '2018-04-01', input_quality_values.iloc[:, -1],
+            ),
+            adjuster.update(
+                '2018-04-01', input_quality_values.iloc[:, -1],
+            ),
+        )
+
+    @pytest.mark.filterwarnings('ignore::RuntimeWarning')
+    @pytest.mark.parametrize('reset_period', range(4))
+    def test_zero_value_reset(self, reset_period):
+        """A zero value gives inf * 0 products, filled with 1 as in pandas."""
+        periods = pd.date_range('2017-03-01', periods=4, freq='MS')
+        quality_values = pd.DataFrame([[0., 2, 4, 8]], columns=periods)
+        to_reset = pd.DataFrame(
+            [[i == reset_period for i in range(4)]], columns=periods,
+        )
+
+        expected_output = get_quality_adjustments(
+            quality_values, to_reset=to_reset,
+        )
+
+        assert_frame_equal(
+            get_quality_adjustments(
+                quality_values, to_reset=to_reset, engine='numpy',
+            ),
+            expected_output,
+        )
+
+        adjuster = IncrementalQualityAdjuster(quality_values.index)
+        output = pd.concat(
+            [
+                adjuster.update(period, quality_values[period], to_reset[period])
+                for period in periods
+            ],
+            axis=1,
+        )
+        assert_frame_equal(output, expected_output, check_names=False)
+
+    @pytest.mark.parametrize("engine", ["pandas", "numpy"])
+    def test_gaps_in_months(self, engine):
+        """Periods are grouped on the period before, as in pandas."""
+        quality_values = cached_dataframe([
+            ('01/11/2017', '01/12/2017', '01/03/2018', '01/04/2018'),
+            (1, 2, 4, 8),
+        ], dtypes='float64', date_columns=True)
+
+        output = get_quality_adjustments(quality_values, engine=engine)
+
+        assert output.iloc[0].tolist() == [1, 2, 4, 2]
+
+    def test_fixtures_resolved_when_read(self, request):
+        """Only FixtureRef parameters are looked up, when first read."""
+        case_parameters = CaseParameters(request, {
+            'to_reset': FixtureRef('to_reset'),
+            'engine': 'to_reset',
+        })
+
+        assert 'to_reset' not in request.fixturenames
+        assert case_parameters['engine'] == 'to_reset'
+
+        to_reset = case_parameters['to_reset']
+        assert isinstance(to_reset, pd.DataFrame)
+        assert case_parameters['to_reset'] is to_reset
+
+
+class TestBasePeriodWindow:
+    """Tests for the BasePeriodWindow segmented operations."""
+
+    @pytest.fixture
+    def input_values(self):
+        """Return float data with NaNs spanning three base periods."""
+        return cached_dataframe([
+            (
+                '01/01/2017', '01/02/2017', '01/03/2017', '01/12/2017',
+                '01/01/2018', '01/02/2018', '01/03/2018',
+            ),
+            (2, 3, None, 2, 5, 4, 2),
+            (None, 1, 2, None, 3, None, 1),
+        ], dtypes='float64', date_columns=True)
+
+    def test_windows_cover_feb_to_jan(self, input_values):
+        """Windows run Feb-Jan+1, ending in each January."""
+        window = BasePeriodWindow(input_values.columns)
+
+        assert list(window.labels) == [2016, 2017, 2018]
+        assert list(window.starts) == [0, 1, 5]
+        assert list(window.stops) == [1, 5, 7]
+        assert list(window.is_window_end) == [True, False, False, False, True, False, True]
+
+    def test_shifted_windows_group_on_period_before(self):
+        """Shifted windows group on the month after the period before."""
+        dates = pd.to_datetime(['2017-11-01', '2017-12-01', '2018-03-01', '2018-04-01'])
+
+        assert list(BasePeriodWindow(dates).period_labels) == [2017, 2017, 2018, 2018]
+
+        # Mar-18 follows Dec-17, so falls in the window ending in Jan-18.
+        window = BasePeriodWindow(dates, shifted=True)
+        assert list(window.period_labels) == [2017, 2017, 2017, 2018]
+        assert list(window.starts) == [0, 3]
+
+    @pytest.mark.parametrize("method", ["cumprod", "cumsum", "ffill"])
+    def test_scans_match_groupby(self, input_values, method):
+        """Scans match the pandas groupby on base period years."""
+        window = BasePeriodWindow(input_values.columns)
+
+        expected = (
+            input_values.T
+            .groupby(window.period_labels)
+            .transform(method)
+            .T
+        )
+
+        assert_frame_equal(getattr(window, method)(input_values), expected)
+        assert_frame_equal(getattr(window, method)(input_values.T, axis=0), expected.T)
+
+    def test_reductions_labelled_by_base_period(self, input_values):
+        """Reductions return one column per base period."""
+        window = BasePeriodWindow(input_values.columns)
+
+        assert_frame_equal(
+            window.any(input_values > 2),
+            pd.DataFrame(
+                [[False, True, True], [False, True, False]],
+                columns=window.labels,
+            ),
+        )
+        assert_frame_equal(
+            window.last(input_values),
+            input_values.iloc[:, [0, 4, 6]].set_axis(window.labels, axis=1),
+        )
+
+    def test_cumulative_adjustments_match_pandas(self, input_values):
+        """get_cumulative_adjustments gives the same result with a window."""
+        window = BasePeriodWindow(input_values.columns)
+
+        assert_frame_equal(
+            get_cumulative_adjustments(input_values, window=window),
+            get_cumulative_adjustments(input_values),
+        )
+
+
+@pytest.fixture(params=[False, True], ids=["numpy_kernels", "numba_kernels"])
+def use_numba(request, monkeypatch):
+    """Switch the kernels used, skipping numba if not installed."""
+    if request.param and kernels.numba is None:
+        pytest.skip("numba is not installed")
+    monkeypatch.setattr(kernels, 'USE_NUMBA', request.param)
+    return request.param
+
+
+class TestKernels:
+    """Tests the windowed reset cumprod gives the same result for each kernel."""
+
+    @pytest.fixture
+    def random_inputs(self):
+        """Return random quality values with NaNs and zeros, and masks."""
+        rng = np.random.default_rng(0)
+        columns = pd.date_range('2016-03-01', periods=40, freq='MS')
+        shape = (60, len(columns))
+
+        quality_value = pd.DataFrame(
+            rng.integers(0, 5, size=shape).astype(float), columns=columns,
+        )
+        quality_value[rng.random(shape) < 0.1] = np.nan
+        to_adjust = pd.DataFrame(rng.random(shape) < 0.5, columns=columns)
+        to_reset = pd.DataFrame(rng.random(shape) < 0.15, columns=columns)
+        return quality_value, to_adjust, to_reset
+
+    # The pandas cumprod warns on inf * 0 from the zero quality values.
+    @pytest.mark.filterwarnings("ignore:invalid value:RuntimeWarning")
+    @pytest.mark.parametrize("masks", [(), ("to_adjust",), ("to_adjust", "to_reset")])
+    def test_kernel_matches_pandas(self, use_numba, random_inputs, masks):
+        """The numpy engine matches the pandas engine with either kernel."""
+        quality_value, to_adjust, to_reset = random_inputs
+        kwargs = {
+            k: v for k, v in [("to_adjust", to_adjust), ("to_reset", to_reset)]
+            if k in masks
+        }
+
+        expected_output = get_quality_adjustments(quality_value, **kwargs)
+        output = get_quality_adjustments(quality_value, **kwargs, engine='numpy')
+
+        assert_frame_equal(output, expected_output, check_exact=True)
+
+    @pytest.mark.parametrize("dtype", ["float64", "float32"])
+    def test_numba_matches_numpy_kernel(self, random_inputs, dtype):
+        """The compiled kernel rounds the same as the NumPy kernel."""
+        if kernels.numba is None:
+            pytest.skip("numba is not installed")
+
+        values, adjust, reset = (df.to_numpy() for df in random_inputs)
+        is_start = np.zeros(values.shape[1], dtype=bool)
+        is_start[BasePeriodWindow(random_inputs[0].columns).starts] = True
+
+        expected = np.empty(values.shape, dtype=dtype)
+        out = np.empty(values.shape, dtype=dtype)
+        kernels._windowed_reset_cumprod_numpy(
+            values, adjust, reset, is_start, expected,
+        )
+        kernels._windowed_reset_cumprod_numba(values, adjust, reset, is_start, out)
+
+        np.testing.assert_array_equal(out, expected)
+
+    def test_environment_forces_numpy_kernels(self, monkeypatch):
+        """FORCE_NUMPY_KERNELS turns off numba when the module is loaded."""
+        use_numba = kernels.USE_NUMBA
+        monkeypatch.setenv('FORCE_NUMPY_KERNELS', '1')
+        try:
+            importlib.reload(kernels)
+            assert not kernels.USE_NUMBA
+        finally:
+            # Put the environment back as it was before reloading.
+            monkeypatch.undo()
+            importlib.reload(kernels)
+
+        assert kernels.USE_NUMBA == use_numba
@@ -1,5 +1,7 @@
-from typing import Sequence
+from typing import Dict, Optional, Sequence, Tuple, Union
+import weakref
 
+import numpy as np
 import pandas as pd
 from pandas._typing import Label
 from pandas._testing import assert_frame_equal
@@ -7,6 +9,7 @@ import pytest
 
 from .helpers import (
     Case,
+    FixtureRef,
     create_dataframe,
     get_case_parameters,
 )
@@ -15,30 +18,236 @@ from .helpers import (
 def get_base_price_imputations(
     to_impute: pd.DataFrame,
     group_on: Sequence[Label],
+    grouper: Optional['LevelGrouper'] = None,
 ) -> pd.DataFrame:
     """Return the index labels where base price imputation occurs.
 
     A base price imputation is needed whenever any of the prices
     need to be imputed for a given period.
+
+    When grouping on index levels, the groups are taken from the index
+    codes, and are cached for the index so repeated calls don't redo
+    them. A prebuilt LevelGrouper can also be passed.
     """
+    if grouper is None and _are_index_levels(to_impute.index, group_on):
+        grouper = get_level_grouper(to_impute.index, group_on)
+
+    if grouper is not None:
+        grouped = grouper.any(to_impute)
+    else:
+        grouped = (
+            to_impute.groupby(group_on)
+            .any()
+            # The above groupby doesn't retain the column name, so rename.
+            .rename_axis(to_impute.columns.name, axis=1)
+        )
+
     return (
-        to_impute.groupby(group_on)
-        .any()
-        # The above groupby doesn't retain the column name, so rename.
-        .rename_axis(to_impute.columns.name, axis=1)
+        grouped
         .pipe(subset_truthy)
         .assign(imputation_type='base_price')
     )
 
 
+class LevelGrouper:
+    """Groups of the rows of an index on some of its levels.
+
+    The groups are worked out once from the integer codes of the index
+    levels, so reductions over them are a single np.logical_or.reduceat
+    rather than going through the generic groupby. Groups are sorted by
+    the level values and rows with missing values are dropped, as with
+    DataFrame.groupby.
+
+    Attributes
+    ----------
+        labels : Index
+            The label of each group, as the index of groupby output.
+        order : ndarray
+            The row positions sorted by group.
+        starts : ndarray
+            The offset of each group in order.
+
+    Examples
+    --------
+    >>> grouper = LevelGrouper(df.index, ['level_1', 'level_2'])
+    >>> grouper.any(df)   # same as df.groupby(['level_1', 'level_2']).any()
+
+    """
+
+    def __init__(self, index: pd.Index, group_on: Union[Label, Sequence[Label]]):
+        """Initialise objects."""
+        levels = [group_on] if _is_single_label(group_on) else list(group_on)
+
+        codes, uniques, names = [], [], []
+        for level in levels:
+            level_codes, level_uniques, name = _get_sorted_level_codes(index, level)
+            codes.append(level_codes)
+            uniques.append(level_uniques)
+            names.append(name)
+
+        # Combine the level codes into a group id that sorts the same
+        # way, leaving out rows with a missing value in any level.
+        valid = np.logical_and.reduce([c >= 0 for c in codes])
+        rows = np.flatnonzero(valid)
+        ids = np.ravel_multi_index(
+            [c[rows] for c in codes], [max(len(u), 1) for u in uniques],
+        )
+
+        sorter = np.argsort(ids, kind='stable')
+        self.order = rows[sorter]
+        sorted_ids = ids[sorter]
+        self.starts = np.flatnonzero(
+            np.r_[len(sorted_ids) > 0, sorted_ids[1:] != sorted_ids[:-1]]
+        )
+        self.is_sorted = len(self.order) == len(index) and bool(
+            np.all(self.order == np.arange(len(index)))
+        )
+
+        first_rows = self.order[self.starts]
+        arrays = [u.take(c[first_rows]) for u, c in zip(uniques, codes)]
+        if len(levels) == 1:
+            self.labels = pd.Index(arrays[0], name=names[0])
+        else:
+            self.labels = pd.MultiIndex.from_arrays(arrays, names=names)
+
+    def __len__(self) -> int:
+        """Return the number of groups."""
+        return len(self.starts)
+
+    def any(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Return whether any value is True for each group and column."""
+        values = df.to_numpy(dtype=bool)
+        if not self.is_sorted:
+            values = values[self.order]
+
+        if len(self):
+            grouped = np.logical_or.reduceat(values, self.starts, axis=0)
+        else:
+            grouped = np.zeros((0, values.shape[1]), dtype=bool)
+
+        return pd.DataFrame(grouped, index=self.labels, columns=df.columns)
+
+
+def _get_sorted_level_codes(
+    index: pd.Index,
+    level: Label,
+) -> Tuple[np.ndarray, pd.Index, Label]:
+    """Return codes for the index level that sort as its values do.
+
+    Reuses the codes of a MultiIndex, only reordering its level values,
+    and falls back to factorizing a flat index.
+    """
+    if not isinstance(index, pd.MultiIndex):
+        codes, uniques = pd.factorize(index, sort=True)
+        return codes, pd.Index(uniques), index.name
+
+    i = index.names.index(level) if level in index.names else level
+    level_values = index.levels[i]
+
+    sorter = level_values.argsort()
+    ranks = np.empty(len(sorter) + 1, dtype=np.intp)
+    ranks[sorter] = np.arange(len(sorter))
+    # Keep missing values as -1, which index the last rank.
+    ranks[-1] = -1
+
+    return ranks[index.codes[i]], level_values.take(sorter), index.names[i]
+
+
+# Cached LevelGroupers, keyed on the id of the index and the levels.
+_LEVEL_GROUPERS: Dict[Tuple[int, Tuple], Tuple[weakref.ref, LevelGrouper]] = {}
+
+
+def get_level_grouper(
+    index: pd.Index,
+    group_on: Union[Label, Sequence[Label]],
+) -> LevelGrouper:
+    """Return the LevelGrouper for the index, cached while it is alive."""
+    levels = (group_on,) if _is_single_label(group_on) else tuple(group_on)
+    key = (id(index), levels)
+
+    cached = _LEVEL_GROUPERS.get(key)
+    if cached is not None and cached[0]() is index:
+        return cached[1]
+
+    grouper = LevelGrouper(index, group_on)
+    _LEVEL_GROUPERS[key] = (
+        weakref.ref(index, lambda _: _LEVEL_GROUPERS.pop(key, None)),
+        grouper,
+    )
+    return grouper
+
+
+def _are_index_levels(
+    index: pd.Index,
+    group_on: Union[Label, Sequence[Label]],
+) -> bool:
+    """Return True if group_on only refers to levels of the index."""
+    levels = [group_on] if _is_single_label(group_on) else list(group_on)
+    return bool(levels) and all(
+        level in index.names and level is not None for level in levels
+    )
+
+
+def _is_single_label(group_on: Union[Label, Sequence[Label]]) -> bool:
+    """Return True if group_on is a single label rather than a list."""
+    return not isinstance(group_on, (list, tuple))
+
+
 def subset_truthy(bool_mask: pd.DataFrame) -> pd.DataFrame:
-    """Return the index labels where the bool mask is True as frame."""
-    levels = list(range(bool_mask.columns.nlevels))
-    return (
-        bool_mask.stack(levels)
-        .pipe(lambda x: x[x])
-        .index.to_frame(index=False)
+    """Return the index labels where the bool mask is True as frame.
+
+    Only the True cells are looked up, so it stays cheap for mostly
+    False masks. Also accepts a mask of Sparse[bool] columns with a
+    False fill value without making it dense.
+    """
+    rows, cols = _truthy_positions(bool_mask)
+
+    if bool_mask.columns.nlevels > 1:
+        # Within each row, stack sorts columns with more than one level
+        # by their values, so give the labels in the same order.
+        order = np.lexsort((_sorted_column_rank(bool_mask.columns)[cols], rows))
+        rows, cols = rows[order], cols[order]
+
+    index = bool_mask.index[rows]
+    columns = bool_mask.columns[cols]
+    return pd.MultiIndex.from_arrays(
+        [index.get_level_values(i) for i in range(index.nlevels)]
+        + [columns.get_level_values(i) for i in range(columns.nlevels)],
+        names=[*bool_mask.index.names, *bool_mask.columns.names],
+    ).to_frame(index=False)
+
+
+def _sorted_column_rank(columns: pd.MultiIndex) -> np.ndarray:
+    """Return the position of each column once sorted by level values."""
+    codes = [
+        pd.factorize(columns.get_level_values(i), sort=True)[0]
+        for i in range(columns.nlevels)
+    ]
+    rank = np.empty(len(columns), dtype=np.intp)
+    rank[np.lexsort(codes[::-1])] = np.arange(len(columns))
+    return rank
+
+
+def _truthy_positions(bool_mask: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the row and column positions of True values, row-major."""
+    is_sparse = len(bool_mask.columns) and all(
+        isinstance(dtype, pd.SparseDtype) and not dtype.fill_value
+        for dtype in bool_mask.dtypes
     )
+    if not is_sparse:
+        return np.nonzero(bool_mask.to_numpy(dtype=bool))
+
+    # Get the positions from the stored values of each sparse column.
+    rows, cols = [], []
+    for j, (_, column) in enumerate(bool_mask.items()):
+        values = column.array
+        truthy = values.sp_index.indices[values.sp_values.astype(bool)]
+        rows.append(truthy)
+        cols.append(np.full(len(truthy), j))
+
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    order = np.lexsort((cols, rows))
+    return rows[order], cols[order]
 
 
 @pytest.fixture
@@ -127,13 +336,13 @@ class TestGetBasePriceImputations:
                 # WHERE there is at least one True in the slice given by those indices
                 # AND a new column 'imputation_type' is created with the value 'base_price'
                 group_on="level_1",
-                expout="expout_grouping_on_level_1",
+                expout=FixtureRef("expout_grouping_on_level_1"),
             ),
             Case(
                 label="grouping_on_both_levels",
                 # Similar to above, just using both levels.
                 group_on=['level_1', 'level_2'],
-                expout="expout_grouping_on_both_levels",
+                expout=FixtureRef("expout_grouping_on_both_levels"),
             ),
         ],
         ids=lambda x: x.label,
@@ -151,4 +360,47 @@ class TestGetBasePriceImputations:
             **case_parameters,
         )
 
-        assert_frame_equal(output, expected_output)
\ No newline at end of file
+        assert_frame_equal(output, expected_output)
+
+
+def test_subset_truthy_sparse_input(imputations_input_data):
+    """subset_truthy gives the same labels for a sparse bool mask."""
+    sparse_mask = imputations_input_data.astype(pd.SparseDtype(bool, False))
+
+    assert_frame_equal(
+        subset_truthy(sparse_mask),
+        subset_truthy(imputations_input_data),
+    )
+
+
+def test_subset_truthy_multilevel_columns():
+    """Labels are in the order stack gives for multi-level columns."""
+    bool_mask = pd.DataFrame(
+        [[True, False, True], [True, True, True]],
+        index=pd.Index(['r1', 'r0'], name='row'),
+        columns=pd.MultiIndex.from_tuples(
+            [('b', 2), ('a', 1), ('b', 1)], names=['letter', 'number'],
+        ),
+    )
+
+    expected_output = pd.DataFrame({
+        'row': ['r1', 'r1', 'r0', 'r0', 'r0'],
+        'letter': ['b', 'b', 'a', 'b', 'b'],
+        'number': [1, 2, 1, 1, 2],
+    })
+
+    assert_frame_equal(subset_truthy(bool_mask), expected_output)
+    assert_frame_equal(
+        subset_truthy(bool_mask.astype(pd.SparseDtype(bool, False))),
+        expected_output,
+    )
+
+
+def test_level_grouper_is_cached(imputations_input_data):
+    """The grouping for an index is only worked out once."""
+    index = imputations_input_data.index
+
+    grouper = get_level_grouper(index, 'level_1')
+
+    assert get_level_grouper(index, 'level_1') is grouper
+    assert get_level_grouper(index, ['level_1', 'level_2']) is not grouper
@@ -1,5 +1,5 @@
 """Parametrisation demonstration - slicing a DataFrame into separate tests."""
-from typing import Callable, List, Optional
+from typing import Callable, Iterable, List, Optional, Sequence, Union
 import warnings
 
 import numpy as np
@@ -10,12 +10,18 @@ import pytest
 
 from .helpers import (
     Case,
-    create_dataframe,
-    slice_dataframes,
+    cached_dataframe,
+    islice_dataframes,
 )
 
+from src import kernels
+from src.base_period import BasePeriodWindow
 
-def add_N2_markers(markers: pd.DataFrame) -> pd.DataFrame:
+
+def add_N2_markers(
+    markers: Union[pd.DataFrame, 'MarkerCodes'],
+    window: Optional[BasePeriodWindow] = None,
+) -> Union[pd.DataFrame, 'MarkerCodes']:
     """Add N2 markers after N markers to denote imputations.
 
     Implements these rules:
@@ -29,31 +35,33 @@ def add_N2_markers(markers: pd.DataFrame) -> pd.DataFrame:
       already, and the next available period is not covered by a new
       base period (i.e. < Jan+1).
 
-    """
-    N_markers_to_deal_with = (markers == 'N')
-
-    MNT_exists = markers.isin(['M', 'N', 'T'])
-    MT_exists = markers.isin(['M', 'T'])
-
-    # Initialise the mask with all False.
-    mask = pd.DataFrame().reindex_like(markers).fillna(False)
-
-    while N_markers_to_deal_with.any(1).any():
-
-        # Shift the mask forward excluding any Trues in Jan, since we
-        # don't want to add N2 markers in a period covered by the next
-        # base period (which is refreshed in Jan - applies Feb-Jan+1).
-        after_N_markers = shift_mask(N_markers_to_deal_with, exclude=[1])
-
-        # Create a new mask for N2's if there are no M, N or T markers
-        # in the next period ahead and append to existing mask.
-        new_mask = after_N_markers & ~MNT_exists
-        mask = mask | new_mask
+    Each row is resolved in a single forward scan over the periods, so
+    the cost doesn't grow with the length of M and T chains. Markers
+    can be passed as strings or as MarkerCodes, and are returned in
+    the same form. Only the column months are used, so no N2 is added
+    after a Jan column, even when the months after it are missing.
 
-        # The N markers we still have to deal with are those that are
-        # followed by an M or T, so set those and loop until all are
-        # dealt with.
-        N_markers_to_deal_with = after_N_markers & MT_exists
+    """
+    months = (
+        window.months if window is not None
+        else pd.DatetimeIndex(markers.columns).month
+    )
+    # Drop the Ns still to deal with in Jan, since we don't want to add
+    # N2 markers in a period covered by the next base period (which is
+    # refreshed in Jan - applies Feb-Jan+1).
+    is_jan = np.asarray(months) == 1
+
+    # Code the markers for the scan, column-major to scan each period.
+    codes = np.zeros(markers.shape, dtype=np.int8, order='F')
+    if isinstance(markers, MarkerCodes):
+        codes[markers.isin(['M', 'T'])] = kernels.MT
+        codes[markers.isin(['N'])] = kernels.N
+    else:
+        values = markers.to_numpy()
+        codes[np.isin(values, ['M', 'T'])] = kernels.MT
+        codes[values == 'N'] = kernels.N
+
+    mask = kernels.propagate_N2(codes, is_jan)
 
     return markers.mask(mask, 'N2')
 
@@ -64,7 +72,7 @@ class TestAddN2Codes:
     @pytest.fixture
     def input_data(self):
         """Return the input data for testing add_N2_codes."""
-        df = create_dataframe([
+        return cached_dataframe([
             (   # columns
                 '01/01/2017', '01/02/2017', '01/03/2017', '01/04/2017', '01/05/2017', '01/06/2017',
                 '01/07/2017', '01/08/2017', '01/09/2017', '01/10/2017', '01/11/2017', '01/12/2017',
@@ -84,14 +92,14 @@ class TestAddN2Codes:
             ('', '', '', 'N', 'M', 'T', 'T', '', 'N', 'T', 'M', 'N', '', '', ''),
             # Test case: doesnt_add_N2_after_multiple_M_and_T_after_N_if_new_base_period
             ('', '', '', '', '', '', '', '', 'N', 'T', 'M', 'M', 'M', '', ''),
-        ])
-        df.columns = pd.to_datetime(df.columns, dayfirst=True)
-        return df
+            # Test case: adds_N2_markers_after_long_chain_of_M_and_T_after_N
+            ('', 'N', 'M', 'T', 'M', 'T', 'M', 'M', 'T', '', '', '', '', '', ''),
+        ], date_columns=True)
 
     @pytest.fixture
     def expout_data(self):
         """Return the expected output for testing add_N2_codes."""
-        df = create_dataframe([
+        return cached_dataframe([
             (   # columns
                 '01/01/2017', '01/02/2017', '01/03/2017', '01/04/2017', '01/05/2017', '01/06/2017',
                 '01/07/2017', '01/08/2017', '01/09/2017', '01/10/2017', '01/11/2017', '01/12/2017',
@@ -111,9 +119,9 @@ class TestAddN2Codes:
             ('', '', '', 'N', 'M', 'T', 'T', 'N2', 'N', 'T', 'M', 'N', 'N2', '', ''),
             # Test case: doesnt_add_N2_after_multiple_M_and_T_after_N_if_new_base_period
             ('', '', '', '', '', '', '', '', 'N', 'T', 'M', 'M', 'M', '', ''),
-        ])
-        df.columns = pd.to_datetime(df.columns, dayfirst=True)
-        return df
+            # Test case: adds_N2_markers_after_long_chain_of_M_and_T_after_N
+            ('', 'N', 'M', 'T', 'M', 'T', 'M', 'M', 'T', 'N2', '', '', '', '', ''),
+        ], date_columns=True)
 
     @pytest.fixture(
         params=[
@@ -165,12 +173,21 @@ class TestAddN2Codes:
                 # EXCEPT if the next available period is covered by a new base period
                 slice=(8, 8),
             ),
+            Case(
+                "adds_N2_markers_after_long_chain_of_M_and_T_after_N",
+                # GIVEN a DataFrame of strings with N, M and T markers
+                # WITH an N code followed by a long chain of M and T codes
+                # WHEN add_N2_markers returns
+                # THEN the resulting DataFrame has an N2 in the first period
+                # AFTER the end of the chain
+                slice=(9, 9),
+            ),
         ],
         ids=lambda x: x.label,
     )
     def input_expout_combinator(self, request, input_data, expout_data):
         """Parametrize the input and outputs using the given data slices."""
-        return slice_dataframes(request.param.slice, input_data, expout_data)
+        return islice_dataframes(request.param.slice, input_data, expout_data)
 
     def test_case(self, input_expout_combinator):
         """Unit tests for add_N2_markers."""
@@ -179,14 +196,164 @@ class TestAddN2Codes:
         true_output = add_N2_markers(input_data)
         assert_frame_equal(true_output, expout_data)
 
+    def test_all_slices_in_one_call(self, input_data, expout_data):
+        """Slicing by many ranges at once gives views of each case."""
+        ranges = [(0, 1), (2, 3), (8, 8), (9, 9)]
+
+        sliced = islice_dataframes(ranges, input_data, expout_data)
+
+        assert len(sliced) == len(ranges)
+        for (start, end), (input_slice, expout_slice) in zip(ranges, sliced):
+            assert_frame_equal(input_slice, input_data.loc[start:end])
+            assert_frame_equal(expout_slice, expout_data.loc[start:end])
+            assert np.shares_memory(input_slice.values, input_data.values)
+
+        with pytest.raises(IndexError):
+            islice_dataframes([(0, 1), (9, 10)], input_data, expout_data)
+
+    @pytest.mark.parametrize("use_numba", [False, True])
+    def test_each_kernel(self, monkeypatch, input_data, expout_data, use_numba):
+        """The N2 markers are the same with the NumPy or numba kernel."""
+        if use_numba and kernels.numba is None:
+            pytest.skip("numba is not installed")
+        monkeypatch.setattr(kernels, 'USE_NUMBA', use_numba)
+
+        assert_frame_equal(add_N2_markers(input_data), expout_data)
+
+    def test_numba_matches_numpy_kernel(self):
+        """The compiled N2 kernel matches the NumPy kernel on random codes."""
+        if kernels.numba is None:
+            pytest.skip("numba is not installed")
+
+        rng = np.random.default_rng(0)
+        codes = np.asfortranarray(
+            rng.choice([kernels.OTHER, kernels.N, kernels.MT], size=(200, 40))
+            .astype(np.int8)
+        )
+        is_window_end = rng.random(40) < 0.1
+
+        expected = np.zeros(codes.shape, dtype=bool, order='F')
+        mask = np.zeros(codes.shape, dtype=bool, order='F')
+        kernels._propagate_N2_numpy(codes, is_window_end, expected)
+        kernels._propagate_N2_numba(codes, is_window_end, mask)
+
+        np.testing.assert_array_equal(mask, expected)
+
+    def test_month_gaps(self):
+        """Only a Jan column stops the N2, whichever months are missing."""
+        markers = pd.DataFrame(
+            [['N', '', ''], ['', 'N', ''], ['N', 'M', '']],
+            columns=pd.to_datetime(['2016-10-01', '2016-12-01', '2017-03-01']),
+        )
+        expected = pd.DataFrame(
+            [['N', 'N2', ''], ['', 'N', 'N2'], ['N', 'M', 'N2']],
+            columns=markers.columns,
+        )
+        assert_frame_equal(add_N2_markers(markers), expected)
+
+        markers.columns = pd.to_datetime(['2016-10-01', '2017-01-01', '2017-03-01'])
+        expected = pd.DataFrame(
+            [['N', 'N2', ''], ['', 'N', ''], ['N', 'M', '']],
+            columns=markers.columns,
+        )
+        assert_frame_equal(add_N2_markers(markers), expected)
+
+    def test_coded_markers(self, input_data, expout_data):
+        """add_N2_markers gives the same markers for MarkerCodes input."""
+        coded = MarkerCodes.from_frame(input_data)
+        assert_frame_equal(coded.to_frame(), input_data)
+
+        true_output = add_N2_markers(coded)
+        assert isinstance(true_output, MarkerCodes)
+        assert_frame_equal(true_output.to_frame(), expout_data)
+
+    def test_missing_markers_kept(self, input_data):
+        """Missing markers stay as they are for DataFrame input."""
+        markers = input_data.mask(input_data == '', None)
+
+        true_output = add_N2_markers(markers)
+
+        assert true_output.dtypes.equals(markers.dtypes)
+        assert true_output.iloc[0, 0] is None
+
+        coded = MarkerCodes.from_frame(markers.replace('T', 'X'))
+        assert (coded.codes[markers.isna().to_numpy()] == -1).all()
+        assert coded.categories[-1] == 'X'
+
+
+class TestAxisValsAsFrame:
+    """Tests for axis_vals_as_frame."""
+
+    @pytest.fixture
+    def input_data(self):
+        """Return a small frame with dates on the columns."""
+        return cached_dataframe([
+            ('01/11/2017', '01/12/2017', '01/01/2018'),
+            (1, 2, 3),
+            (4, 5, 6),
+        ], date_columns=True)
+
+    @pytest.mark.parametrize("axis", [0, 1])
+    def test_view_matches_copy(self, input_data, axis):
+        """The broadcast view has the same values as the copy."""
+        converter = (lambda x: x.month) if axis else None
+
+        copied = axis_vals_as_frame(input_data, axis, converter=converter)
+        view = axis_vals_as_frame(
+            input_data, axis, converter=converter, copy=False,
+        )
+
+        assert_frame_equal(view, copied, check_dtype=False)
+        assert not view.to_numpy().flags.writeable
+
+
+class TestShiftMask:
+    """Tests for shift_mask."""
+
+    @pytest.fixture
+    def input_mask(self):
+        """Return a boolean mask spanning a new base period."""
+        return cached_dataframe([
+            ('01/11/2017', '01/12/2017', '01/01/2018', '01/02/2018'),
+            (True, False, True, False),
+            (False, True, True, True),
+        ], date_columns=True)
+
+    @pytest.fixture
+    def expout_excluding_jan(self):
+        """Return the mask shifted a period forward, excluding Jan."""
+        return cached_dataframe([
+            ('01/11/2017', '01/12/2017', '01/01/2018', '01/02/2018'),
+            (False, True, False, False),
+            (False, False, True, False),
+        ], date_columns=True)
+
+    def test_shift_excluding_jan(self, input_mask, expout_excluding_jan):
+        """The shifted mask is the same for each storage option."""
+        assert_frame_equal(
+            shift_mask(input_mask, exclude=[1]), expout_excluding_jan,
+        )
+
+        out = np.ones(input_mask.shape, dtype=bool)
+        assert_frame_equal(
+            shift_mask(input_mask, exclude=[1], out=out), expout_excluding_jan,
+        )
+        # The output buffer is written to in place.
+        assert (out == expout_excluding_jan.to_numpy()).all()
+
+        packed = shift_mask(PackedMask.from_frame(input_mask), exclude=[1])
+        assert_frame_equal(packed.to_frame(), expout_excluding_jan)
+
 
 def shift_mask(
-    mask: pd.DataFrame,
+    mask: Union[pd.DataFrame, 'PackedMask'],
     periods: int = 1,
     axis: int = 1,
     exclude: Optional[List[int]] = None,
     only_include: Optional[List[int]] = None,
-) -> pd.DataFrame:
+    window: Optional[BasePeriodWindow] = None,
+    out: Optional[np.ndarray] = None,
+) -> Union[pd.DataFrame, 'PackedMask']:
     """Shift a boolean mask by given number of periods.
 
     There are additional options to exclude or only include any months
@@ -194,9 +361,13 @@ def shift_mask(
     equivalent). An argument should be passed to only one of these
     parameters on each function call.
 
+    The shift stays in bool dtype throughout. For very large panels
+    the mask can be given as a PackedMask, which is shifted without
+    unpacking.
+
     Parameters
     ----------
-    mask: DataFrame
+    mask: DataFrame or PackedMask
         The boolean mask to shift.
     periods: int, default 1
         The number of periods to shift by (currently only months).
@@ -206,10 +377,15 @@ def shift_mask(
         The monthly periods to exclude from the shift.
     only_include: list of ints, optional
         The only monthly periods to include in the shift.
+    window: BasePeriodWindow, optional
+        Prebuilt windows for the columns, to reuse their months.
+    out: ndarray, optional
+        A preallocated bool array the shape of mask to write into. The
+        returned DataFrame is backed by it. Not used for a PackedMask.
 
     Returns
     -------
-    DataFrame
+    DataFrame or PackedMask
         The shifted boolean mask.
     """
     if exclude and only_include:
@@ -219,16 +395,61 @@ def shift_mask(
             UserWarning,
         )
 
+    # Only the column months are needed to know which to keep.
+    keep = None
     if exclude or only_include:
-        months = axis_vals_as_frame(mask, axis=1, converter=lambda x: x.month)
+        months = window.months if window is not None else mask.columns.month
 
         if exclude:
-            mask = mask & (~months.isin(exclude))
+            keep = ~np.isin(months, exclude)
 
         elif only_include:
-            mask = mask & months.isin(only_include)
+            keep = np.isin(months, only_include)
+
+    if keep is not None and axis == 1:
+        # Keep the shifted values from the kept columns.
+        keep = _shift_array(keep, periods, axis=0, out=np.empty_like(keep))
+
+    if isinstance(mask, PackedMask):
+        if axis != 1:
+            raise ValueError("A PackedMask can only be shifted on axis 1.")
+
+        bits = _shift_array(mask.bits, periods, axis, np.empty_like(mask.bits))
+        if keep is not None:
+            bits &= np.where(keep, 0xFF, 0).astype(np.uint8)
+
+        return PackedMask(bits, mask.index, mask.columns)
+
+    values = mask.to_numpy(dtype=bool)
+    if out is None:
+        out = np.empty_like(values)
+
+    _shift_array(values, periods, axis, out)
+    if keep is not None:
+        out &= keep
+
+    return pd.DataFrame(out, index=mask.index, columns=mask.columns, copy=False)
+
+
+def _shift_array(
+    values: np.ndarray,
+    periods: int,
+    axis: int,
+    out: np.ndarray,
+) -> np.ndarray:
+    """Shift values along the axis into out, filling with zeros."""
+    src = np.moveaxis(values, axis, 0)
+    dst = np.moveaxis(out, axis, 0)
+    n = min(abs(periods), len(src))
+
+    if periods >= 0:
+        dst[n:] = src[:len(src) - n]
+        dst[:n] = 0
+    else:
+        dst[:len(src) - n] = src[n:]
+        dst[len(src) - n:] = 0
 
-    return mask.shift(periods, axis=axis).fillna(False)
+    return out
 
 
 def axis_vals_as_frame(
@@ -236,12 +457,17 @@ def axis_vals_as_frame(
     axis: int = 0,
     levels: Optional[Level] = None,
     converter: Callable[[pd.Index], pd.Index] = None,
+    copy: bool = True,
 ) -> pd.DataFrame:
     """Broadcast axis values across the DataFrame.
 
     Pick the axis and optional MultiIndex level. Optionally
     transform the index object before broadcasting.
 
+    With copy=False the frame is backed by a read-only broadcast view
+    of the axis values, so no full-size arrays are allocated. It keeps
+    the dtype of the axis values rather than the dtypes of df.
+
     Parameters
     ----------
     df: DataFrame
@@ -251,6 +477,8 @@ def axis_vals_as_frame(
         Either the integer position or the name of the level.
     converter: callable
         A function to transform an index object.
+    copy: bool, default True
+        If False, return a read-only broadcast view of the values.
 
     Returns
     -------
@@ -268,6 +496,17 @@ def axis_vals_as_frame(
     # Prepare the values to pass to np.tile which reshapes to the df.
     if not isinstance(vals, np.ndarray):
         vals = vals.values
+
+    if not copy:
+        if axis == 0:
+            vals = vals[:, None]
+        return pd.DataFrame(
+            np.broadcast_to(vals, df.shape),
+            index=df.index,
+            columns=df.columns,
+            copy=False,
+        )
+
     reps = (df.shape[axis ^ 1], 1)
 
     if axis == 0:
@@ -279,3 +518,172 @@ def axis_vals_as_frame(
     df_out.loc[:, :] = np.tile(vals, reps)
 
     return df_out
+
+
+# The markers a MarkerCodes panel is always able to hold.
+MARKER_CATEGORIES = ('', 'M', 'N', 'N2', 'T')
+
+
+class MarkerCodes:
+    """A panel of markers stored as small integer codes.
+
+    Holds a 2-D array of codes into `categories`, so that membership
+    tests and masking run as integer array operations and take a
+    fraction of the memory of an object-dtype DataFrame of strings.
+    Missing values have the code -1.
+
+    Attributes
+    ----------
+        codes : ndarray
+            The integer codes, the same shape as the marker frame.
+        categories : Index
+            The marker for each code.
+        index, columns : Index
+            The axes of the marker frame.
+
+    Examples
+    --------
+    >>> coded = MarkerCodes.from_frame(markers)
+    >>> coded.mask(coded.isin(['M', 'T']), '').to_frame()
+
+    """
+
+    def __init__(
+        self,
+        codes: np.ndarray,
+        categories: Sequence[str],
+        index: pd.Index,
+        columns: pd.Index,
+    ):
+        """Initialise objects."""
+        self.codes = codes
+        self.categories = pd.Index(categories, dtype=object)
+        self.index = index
+        self.columns = columns
+
+    def __repr__(self) -> str:
+        """Return string."""
+        return (
+            f"MarkerCodes(shape={self.shape}, "
+            f"categories={list(self.categories)!r})"
+        )
+
+    @property
+    def shape(self):
+        """Return the shape of the marker panel."""
+        return self.codes.shape
+
+    @classmethod
+    def from_frame(
+        cls,
+        markers: pd.DataFrame,
+        categories: Sequence[str] = MARKER_CATEGORIES,
+    ) -> 'MarkerCodes':
+        """Code a DataFrame of string markers.
+
+        Any markers not in `categories` are added to the end of them.
+        """
+        values = markers.to_numpy().ravel(order='F')
+
+        # Factorize once, then map the observed markers to categories.
+        codes, observed = pd.factorize(values)
+        categories = pd.Index(categories, dtype=object)
+        categories = categories.append(
+            pd.Index(observed, dtype=object).difference(categories, sort=False)
+        )
+
+        # The extra -1 at the end keeps missing values as -1.
+        dtype = np.promote_types(np.int8, np.min_scalar_type(-len(categories)))
+        lookup = np.append(categories.get_indexer(observed), -1).astype(dtype)
+        codes = lookup[codes]
+        return cls(
+            codes.reshape(markers.shape, order='F'),
+            categories,
+            markers.index,
+            markers.columns,
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """Return the markers as a DataFrame of strings."""
+        # The extra NaN at the end is picked up by the -1 codes.
+        lookup = np.append(self.categories.to_numpy(), np.nan)
+        return pd.DataFrame(
+            lookup[self.codes], index=self.index, columns=self.columns,
+        )
+
+    def isin(self, values: Iterable[str]) -> np.ndarray:
+        """Return a boolean mask of where the markers are in values."""
+        values = list(values)
+
+        lookup = np.zeros(len(self.categories) + 1, dtype=bool)
+        positions = self.categories.get_indexer(values)
+        lookup[positions[positions >= 0]] = True
+        lookup[-1] = any(pd.isna(v) for v in values)
+
+        return lookup[self.codes]
+
+    def mask(self, cond: np.ndarray, value: str) -> 'MarkerCodes':
+        """Return new MarkerCodes with value where cond is True."""
+        categories = self.categories
+        if value not in categories:
+            categories = categories.append(pd.Index([value], dtype=object))
+
+        # Make sure the codes can hold any new category.
+        dtype = np.promote_types(
+            self.codes.dtype, np.min_scalar_type(-len(categories)),
+        )
+        codes = self.codes.astype(dtype, order='K')
+        codes[np.asarray(cond)] = categories.get_loc(value)
+
+        return MarkerCodes(codes, categories, self.index, self.columns)
+
+
+class PackedMask:
+    """A boolean mask bit-packed along the rows.
+
+    Stores eight rows per byte with np.packbits, so a mask over a very
+    large marker panel takes an eighth of the memory. Each column stays
+    a separate run of bytes, so it can be shifted along the columns
+    without unpacking.
+
+    Attributes
+    ----------
+        bits : ndarray
+            The packed uint8 array, with a row for each eight rows.
+        index, columns : Index
+            The axes of the mask.
+
+    Examples
+    --------
+    >>> packed = PackedMask.from_frame(mask)
+    >>> shift_mask(packed, exclude=[1]).to_frame()
+
+    """
+
+    def __init__(self, bits: np.ndarray, index: pd.Index, columns: pd.Index):
+        """Initialise objects."""
+        self.bits = bits
+        self.index = index
+        self.columns = columns
+
+    def __repr__(self) -> str:
+        """Return string."""
+        return f"PackedMask(shape={self.shape}, nbytes={self.bits.nbytes})"
+
+    @property
+    def shape(self):
+        """Return the shape of the unpacked mask."""
+        return (len(self.index), len(self.columns))
+
+    @classmethod
+    def from_frame(cls, mask: pd.DataFrame) -> 'PackedMask':
+        """Pack a boolean DataFrame."""
+        bits = np.packbits(mask.to_numpy(dtype=bool), axis=0)
+        return cls(bits, mask.index, mask.columns)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Return the unpacked boolean DataFrame."""
+        values = np.unpackbits(self.bits, axis=0, count=len(self.index))
+        return pd.DataFrame(
+            values.view(bool), index=self.index, columns=self.columns,
+        )
@@ -1,5 +1,6 @@
-from typing import Mapping, Sequence
+from typing import Any, Callable, Iterable, Iterator, Mapping, Sequence
 
+import numpy as np
 import pandas as pd
 from pandas._testing import assert_frame_equal
 import pytest
@@ -32,10 +33,83 @@ def filter_retailer_items(
         Local collection data after filtering out Alt source data.
 
     """
-    for shop_code, items in alt_data_filter.items():
-        df = df.query('not (item_id == @items and shop_code == @shop_code)')
+    keys = get_retailer_item_keys(alt_data_filter)
+    return df[~is_retailer_item(df, keys)]
 
-    return df
+
+def iter_filter_retailer_items(
+    chunks: Iterable[pd.DataFrame],
+    alt_data_filter: Mapping[int, Sequence[int]],
+) -> Iterator[pd.DataFrame]:
+    """Filter items from retailers present in alt sources data by chunk.
+
+    A streaming version of filter_retailer_items for local collection
+    data too large to hold in memory. The shop/item lookup is built
+    once, and each chunk is filtered as it is read, so memory is
+    bounded by the chunk size.
+
+    Parameters
+    ----------
+    chunks: iterable of DataFrames
+        The local collection data, e.g. from pd.read_csv(chunksize=...).
+    alt_data_filter: dictionary key=retailer codes: value=list of item codes
+        The shop/item codes covered in the alternative data sources
+        pipeline, used for dropping rows that match.
+
+    Yields
+    ------
+    DataFrame
+        Each chunk after filtering out Alt source data.
+
+    Examples
+    --------
+    >>> chunks = pd.read_csv('local_collection.csv', chunksize=100_000)
+    >>> for chunk in iter_filter_retailer_items(chunks, alt_data_filter):
+    ...     process(chunk)
+
+    """
+    keys = get_retailer_item_keys(alt_data_filter)
+    for chunk in chunks:
+        yield chunk[~is_retailer_item(chunk, keys)]
+
+
+def write_filtered_retailer_items(
+    chunks: Iterable[pd.DataFrame],
+    alt_data_filter: Mapping[int, Sequence[int]],
+    sink: Callable[[pd.DataFrame], Any],
+) -> int:
+    """Filter the chunks and pass each one straight to the sink.
+
+    See iter_filter_retailer_items for the parameters. The sink is
+    called once per filtered chunk, e.g. a function appending it to a
+    CSV or Parquet file. Returns the total number of rows kept.
+    """
+    n_rows = 0
+    for chunk in iter_filter_retailer_items(chunks, alt_data_filter):
+        sink(chunk)
+        n_rows += len(chunk)
+
+    return n_rows
+
+
+def get_retailer_item_keys(
+    alt_data_filter: Mapping[int, Sequence[int]],
+) -> pd.MultiIndex:
+    """Return the shop/item code pairs in the filter as a lookup."""
+    return pd.MultiIndex.from_tuples(
+        [
+            (shop_code, item_id)
+            for shop_code, items in alt_data_filter.items()
+            for item_id in items
+        ],
+        names=['shop_code', 'item_id'],
+    )
+
+
+def is_retailer_item(df: pd.DataFrame, keys: pd.MultiIndex) -> np.ndarray:
+    """Return a boolean mask of the rows with shop/item codes in keys."""
+    rows = pd.MultiIndex.from_arrays([df['shop_code'], df['item_id']])
+    return rows.isin(keys)
 
 
 class TestFilterRetailerItems:
@@ -160,4 +234,74 @@ class TestFilterRetailerItems:
     ):
         """Test the different filtering cases."""
         output_df = filter_retailer_items(filter_retailer_input, alt_data_filter)
-        assert_frame_equal(output_df.reset_index(drop=True), expout)
\ No newline at end of file
+        assert_frame_equal(output_df.reset_index(drop=True), expout)
+
+    @parametrize_cases(
+        Case(label=f"chunksize_{n}", chunksize=n) for n in [1, 3, 8]
+    )
+    def test_chunked_matches_in_memory(self, filter_retailer_input, chunksize):
+        """Filtering by chunk gives the same rows as filtering in memory."""
+        alt_data_filter = {12: [654, 321], 34: [987]}
+        chunks = (
+            filter_retailer_input.iloc[i:i + chunksize]
+            for i in range(0, len(filter_retailer_input), chunksize)
+        )
+
+        written = []
+        n_rows = write_filtered_retailer_items(
+            chunks, alt_data_filter, written.append,
+        )
+
+        expected = filter_retailer_items(filter_retailer_input, alt_data_filter)
+        assert n_rows == len(expected)
+        assert_frame_equal(pd.concat(written), expected)
+
+
+class TestCase:
+    """Tests for the Case container."""
+
+    def test_dot_access_for_any_name(self):
+        """Parameters named like the internal slots are still returned."""
+        case = Case("x", values=[1, 2], keys=('a',), expout=3)
+
+        assert case.values == [1, 2]
+        assert case.keys == ('a',)
+        assert case.expout == 3
+        assert case.kwargs == {'values': [1, 2], 'keys': ('a',), 'expout': 3}
+
+    @parametrize_cases(
+        Case("named_values", values=[1, 2], keys=3),
+    )
+    def test_parametrize_names_like_slots(self, values, keys):
+        """Parameters named values and keys are passed to the test."""
+        assert values == [1, 2]
+        assert keys == 3
+
+
+class TestCreateDataFrame:
+    """Tests for building fixtures with create_dataframe."""
+
+    def test_cached_values_of_equal_types_kept_apart(self):
+        """Fixtures with equal values of other types aren't mixed up."""
+        ints = create_dataframe([('a', 'b'), (1, 0), (0, 1)], cached=True)
+        floats = create_dataframe([('a', 'b'), (1., 0.), (0., 1.)], cached=True)
+        bools = create_dataframe(
+            [('a', 'b'), (True, False), (False, True)], cached=True,
+        )
+
+        assert (ints.dtypes == 'int64').all()
+        assert (floats.dtypes == 'float64').all()
+        assert (bools.dtypes == 'bool').all()
+
+    @pytest.mark.parametrize("cached", [False, True])
+    def test_axes_not_shared(self, cached):
+        """Renaming the axes of one fixture doesn't rename another's."""
+        tuple_data = [('01/01/2017', '01/02/2017'), (1, 2)]
+
+        df = create_dataframe(tuple_data, date_columns=True, cached=cached)
+        df.columns.name = 'period'
+        df.index.name = 'item'
+
+        other = create_dataframe(tuple_data, date_columns=True, cached=cached)
+        assert other.columns.name is None
+        assert other.index.name is None